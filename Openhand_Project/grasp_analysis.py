@@ -9,28 +9,98 @@
 #Normal Grasp -> python grasp_analysis.py cy_grasp_data.csv 
 #Palm Grasp -> python grasp_analysis.py cy_palm_data.csv
 #Pinch Grasp -> python grasp_analysis.py cy_pinch_data.csv
+#Large captures (chunked, joint angles written to a .npy file) -> python grasp_analysis.py --stream capture.csv angles.npy
+#Many captures (parallel, headless, summary table) -> python grasp_analysis.py --batch captures/ [--workers N] [--out summary.csv] [--plots DIR] [--results DIR]
+#Save figures as files instead of opening windows -> python grasp_analysis.py cy_grasp_data.csv --output figures/ [--format svg]
+#Save joint angles, link lengths and positions as compressed columns -> python grasp_analysis.py cy_grasp_data.csv --results cy_grasp.npz
+#Animate the grasp reconstructed from the joint angles -> python grasp_analysis.py cy_grasp_data.csv --output figures/ --animate grasp.gif
 
 #######################################################################################
+import os
 import sys
 import csv
+import glob
+import json
+import time
+import argparse
+import functools
+import multiprocessing
 import numpy as np
 import matplotlib.pyplot as plt
-from math import sqrt,pi
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib import animation
 
-#Open csv and read joint position data into numpy list
+try:
+	from concurrent.futures import ProcessPoolExecutor
+except ImportError:
+	ProcessPoolExecutor = None #Python 2 without the futures backport, batch mode falls back to multiprocessing.Pool
+
+#Number of columns in a capture: proximal x, proximal z, distal x, distal z of finger 1 then finger 2
+CAPTURE_COLUMNS = 8
+
+#Parse csv text of whole rows into a float64 (rows, 8) array
+def parse_rows(text, filename):
+	text = text.strip()
+	rows = text.count(b'\n') + 1 if text else 0
+	values = np.fromstring(text.replace(b'\n', b','), dtype=np.float64, sep=',')
+	if values.size != rows * CAPTURE_COLUMNS:
+		raise ValueError("{0} does not have {1} values on every row".format(filename, CAPTURE_COLUMNS))
+	return values.reshape(rows, CAPTURE_COLUMNS)
+
+#Parse a capture csv straight into a float64 (N, 8) array
+def parse_capture(filename):
+	with open(filename, 'rb') as csvfile:
+		return parse_rows(csvfile.read(), filename)
+
+#Sidecar cache files of a capture: parsed array and the size/mtime of the csv it came from
+def cache_paths(filename):
+	return filename + '.npy', filename + '.npy.json'
+
+#Memory-map the cache of a capture, or return None when there is no cache or the csv changed since it was written
+def cached_capture(filename):
+	st = os.stat(filename)
+	npy_path, meta_path = cache_paths(filename)
+	try:
+		with open(meta_path) as f:
+			meta = json.load(f)
+		if meta['size'] == st.st_size and meta['mtime'] == st.st_mtime:
+			return np.load(npy_path, mmap_mode='r')
+	except (IOError, OSError, ValueError, KeyError):
+		pass
+	return None
+
+#Load a capture as a float64 (N, 8) array
+#The first load writes a .npy cache next to the csv, later loads memory-map it as long as the csv size and mtime still match
+def load_capture(filename, cache = True):
+	st = os.stat(filename)
+	npy_path, meta_path = cache_paths(filename)
+	if cache:
+		data = cached_capture(filename)
+		if data is not None:
+			return data
+
+	data = parse_capture(filename)
+	if cache:
+		#Write under temporary names and rename so a crash never leaves a cache that looks valid
+		try:
+			with open(npy_path + '.tmp', 'wb') as f:
+				np.save(f, data)
+			os.rename(npy_path + '.tmp', npy_path)
+			with open(meta_path + '.tmp', 'w') as f:
+				json.dump({'size': st.st_size, 'mtime': st.st_mtime, 'shape': list(data.shape)}, f)
+			os.rename(meta_path + '.tmp', meta_path)
+		except (IOError, OSError):
+			pass
+	return data
+
+#Open csv and read joint position data into a float64 numpy array
 def open_csv_to_list(filename):
-    words = []
     try:
-	    with open(filename, 'rb') as csvfile:
-	     	reader = csv.reader(csvfile)
-	        for line in reader:
-	        	words.append(line)
-    except:
+        return load_capture(filename)
+    except (IOError, OSError):
         sys.exit(str(filename)+ " "+ "does not exist")
 
-    words_np = np.array(words)
-    return words_np
-
 #Check whether command line argument is less than 1
 def check_argument():
     usr_argv = sys.argv[1]
@@ -38,6 +108,140 @@ def check_argument():
         sys.exit("No csv file detected") #system exit if argument less than 1
     return usr_argv
 
+#Proximal joint origin (x, z) of each finger
+FINGER_ORIGINS = {1: (0.024, 0.06), 2: (0.05, 0.06)}
+
+#Calculate link lengths and joint angles of every sample with whole-array operations
+#pos holds one row per sample: proximal x, proximal z, distal x, distal z
+#mirrored is used for finger 1 (left finger on the plot), its angles are measured from the absolute x offset
+def joint_angles(pos, oX, oZ, mirrored = False):
+	pos = np.asarray(pos, dtype=np.float64)
+	prox_dx = pos[:,0] - oX
+	dist_dx = pos[:,2] - pos[:,0]
+	#Matches the per-sample scalar code within a few ulp. With NumPy 1.16 np.power calls pow() like the scalar ** it
+	#replaces and the results are bit-identical, newer NumPy squares through x*x like x**2
+	prox_length = np.sqrt(np.power(prox_dx, 2) + np.power(pos[:,1] - oZ, 2))
+	distal_length = np.sqrt(np.power(dist_dx, 2) + np.power(pos[:,3] - pos[:,1], 2))
+	if mirrored:
+		prox_dx = np.abs(prox_dx)
+		dist_dx = np.abs(dist_dx)
+	prox_joint_angles = np.arccos(prox_dx / prox_length)
+	dist_joint_angles = np.arccos(dist_dx / distal_length)
+	return prox_length, distal_length, prox_joint_angles, dist_joint_angles
+
+#Grasp phases in the order a trial goes through them
+PHASE_NAMES = ['Grasp Setup', 'Pre-Grasp', 'Final Grasp']
+
+#Joint speed (largest change of any joint angle, rad per sample, smoothed over PHASE_SMOOTHING samples) above which the
+#hand counts as moving, and the number of still samples after a movement that make the grasp final
+#OptiTrack noise on the bundled captures is about 5e-5 rad per sample, finger motion 1e-3 to 1e-2
+PHASE_SPEED = 5e-4
+PHASE_SMOOTHING = 25
+PHASE_HOLD = 50
+
+#Per-sample moving flags of joint angles (N, joints): the joint speed (largest change of any angle from the previous
+#sample) averaged over the last smoothing samples is above speed
+#Chunks of one trial can be passed in order with the carry returned by the previous chunk (last angles and speeds)
+def moving_flags(angles, carry = None, speed = PHASE_SPEED, smoothing = PHASE_SMOOTHING):
+	angles = np.asarray(angles, dtype=np.float64)
+	previous, history = (angles[:1], np.zeros(0)) if carry is None else carry
+	steps = np.abs(np.diff(np.concatenate([previous, angles]), axis = 0)).max(axis = 1)
+	padded = np.concatenate([history, steps])
+	total = np.concatenate([[0.0], np.cumsum(padded)])
+	end = np.arange(len(history), len(padded)) + 1
+	smoothed = (total[end] - total[np.maximum(end - smoothing, 0)]) / smoothing
+	return smoothed > speed, (angles[-1:], padded[max(len(padded) - (smoothing - 1), 0):])
+
+#Sample ranges where flags is set, as (starts, stops) arrays shifted by offset
+def flag_runs(flags, offset = 0):
+	edges = np.diff(np.concatenate([[0], np.asarray(flags, dtype=np.int8), [0]]))
+	return np.flatnonzero(edges == 1) + offset, np.flatnonzero(edges == -1) + offset
+
+#Grasp phases of a trial of n samples from its movements (starts, stops)
+#Movements less than hold samples apart are one movement with a pause. Grasp Setup is everything before the first
+#movement, Final Grasp everything after the last one and Pre-Grasp the rest.
+#Returns (bounds, frames): bounds[i] is the (start, stop) sample range of PHASE_NAMES[i] and frames[i] the sample that
+#shows it: the last still sample of Grasp Setup, the middle of the longest pause inside Pre-Grasp (the middle of
+#Pre-Grasp when there is no pause) and the last sample of the trial
+#A trial without movement keeps the first, middle and last sample as frames
+def phases_from_runs(starts, stops, n, hold = PHASE_HOLD):
+	starts = np.asarray(starts, dtype=np.int64)
+	stops = np.asarray(stops, dtype=np.int64)
+	if len(starts) == 0:
+		return [(0, n), (n, n), (n, n)], [0, n // 2, n - 1]
+	gaps = starts[1:] - stops[:-1]
+	starts = starts[np.concatenate([[True], gaps >= hold])]
+	stops = stops[np.concatenate([gaps >= hold, [True]])]
+	first, last = int(starts[0]), int(stops[-1])
+	bounds = [(0, first), (first, last), (last, n)]
+	if len(starts) > 1:
+		pause = int(np.argmax(starts[1:] - stops[:-1]))
+		pre_frame = (int(stops[pause]) + int(starts[pause + 1])) // 2
+	else:
+		pre_frame = (first + last) // 2
+	return bounds, [max(first - 1, 0), pre_frame, n - 1]
+
+#Grasp phases of a trial from its joint angles (N, joints), see phases_from_runs for what is returned
+def segment_phases(angles, speed = PHASE_SPEED, smoothing = PHASE_SMOOTHING, hold = PHASE_HOLD):
+	flags, carry = moving_flags(angles, None, speed, smoothing)
+	starts, stops = flag_runs(flags)
+	return phases_from_runs(starts, stops, len(flags), hold)
+
+#Joint angles of both fingers as (N, 4) columns: finger 1 proximal, distal, finger 2 proximal, distal
+def trial_angles(f1, f2):
+	return np.column_stack([f1.prox_joint_angles, f1.dist_joint_angles, f2.prox_joint_angles, f2.dist_joint_angles])
+
+#Positions of the two joints of a finger from its joint angles and link lengths, for every sample at once
+#Angles are arrays (or scalars), lengths broadcast against them (measured per sample or one value per link)
+#Returns (N, 4) columns like a capture: proximal x, proximal z, distal x, distal z
+#Inverse of joint_angles: mirrored fingers point towards -x, both fingers are taken to point up (+z) from each joint
+def forward_kinematics(prox_joint_angles, dist_joint_angles, prox_length, distal_length, oX, oZ, mirrored = False):
+	prox_joint_angles = np.asarray(prox_joint_angles, dtype=np.float64).reshape(-1)
+	dist_joint_angles = np.asarray(dist_joint_angles, dtype=np.float64).reshape(-1)
+	sign = -1.0 if mirrored else 1.0
+	pos = np.empty((len(prox_joint_angles), 4))
+	pos[:,0] = oX + sign * prox_length * np.cos(prox_joint_angles)
+	pos[:,1] = oZ + prox_length * np.sin(prox_joint_angles)
+	pos[:,2] = pos[:,0] + sign * distal_length * np.cos(dist_joint_angles)
+	pos[:,3] = pos[:,1] + distal_length * np.sin(dist_joint_angles)
+	return pos
+
+#Both fingers of a trial from trial_angles columns (N, 4) and lengths (f1 proximal, f1 distal, f2 proximal, f2 distal)
+#given per sample (N, 4) or per trial (4,), returns (N, 8) positions in the capture column order
+def grasp_forward_kinematics(angles, lengths, origins = FINGER_ORIGINS):
+	angles = np.asarray(angles, dtype=np.float64).reshape(-1, 4)
+	lengths = np.asarray(lengths, dtype=np.float64)
+	return np.hstack([forward_kinematics(angles[:,0], angles[:,1], lengths[...,0], lengths[...,1], origins[1][0], origins[1][1], mirrored = True),
+		forward_kinematics(angles[:,2], angles[:,3], lengths[...,2], lengths[...,3], origins[2][0], origins[2][1])])
+
+#Link lengths of a trial as (4,): the median of the measured lengths of each link, the links are rigid
+def link_lengths(f1, f2):
+	return np.median(np.column_stack([f1.prox_length, f1.distal_length, f2.prox_length, f2.distal_length]), axis = 0)
+
+#Raw positions (N, 8) with every link turned the way joint_angles reads it: arccos drops the z sign of each link and
+#the x sign of the mirrored finger 1, so its links point towards -x and every link points up (+z)
+def fold_positions(pos, origins = FINGER_ORIGINS):
+	pos = np.asarray(pos, dtype=np.float64)
+	folded = np.empty_like(pos)
+	for no, first in [(1, 0), (2, 4)]:
+		joint_x, joint_z = origins[no]
+		for column in (first, first + 2):
+			dx = pos[:,column] - (joint_x if column == first else pos[:,column - 2])
+			dz = pos[:,column + 1] - (joint_z if column == first else pos[:,column - 1])
+			if no == 1:
+				dx = -np.abs(dx)
+			folded[:,column] = (joint_x if column == first else folded[:,column - 2]) + dx
+			folded[:,column + 1] = (joint_z if column == first else folded[:,column - 1]) + np.abs(dz)
+	return folded
+
+#Distance between raw and reconstructed positions (both (N, 8) in capture order) of each marker, as (N, 4) columns
+#f1 proximal, f1 distal, f2 proximal, f2 distal
+#The raw positions are folded first (fold_positions), so the link directions that joint angles cannot tell apart do
+#not count as error and what remains is how far the markers are from rigid links of the given lengths
+def reconstruction_error(pos, reconstructed, origins = FINGER_ORIGINS):
+	d = fold_positions(pos, origins) - reconstructed
+	return np.sqrt(d[:,0::2] * d[:,0::2] + d[:,1::2] * d[:,1::2])
+
 #Initiate a class for a finger
 class finger():
 	def __init__(self,pos):
@@ -45,7 +249,7 @@ class finger():
 		self.distal_z = []
 		self.proximal_x = []
 		self.proximal_z = []
-		self.pos = pos
+		self.pos = np.asarray(pos, dtype=np.float64)
 		self.currpos_x = []
 		self.currpos_z = []
 		self.prox_length = 0
@@ -55,164 +259,519 @@ class finger():
 
 	#Store proximal joint positions based on x and z direction
 	def proximal_pos(self):
-		for i in xrange(len(self.pos)):
-			self.proximal_x.append(float(self.pos[i,0]))
-			self.proximal_z.append(float(self.pos[i,1]))			
-
+		self.proximal_x = self.pos[:,0]
+		self.proximal_z = self.pos[:,1]
 		return None
 
 	#Store distal joint positions based on x and z direction
 	def distal_pos(self):
-		for i in xrange(len(self.pos)):
-			self.distal_x.append(float(self.pos[i,2]))
-			self.distal_z.append(float(self.pos[i,3]))			
+		self.distal_x = self.pos[:,2]
+		self.distal_z = self.pos[:,3]
 		return None
 
-	#Store finger positions based on x and z direction
+	#Store finger positions based on x and z direction (one [proximal, distal] row per sample)
 	def finger_pos(self):
-		px = []
-		pz = []
-		for i in xrange(len(self.pos)):
-			px = [float(self.pos[i,0]), float(self.pos[i,2])]
-			pz = [float(self.pos[i,1]), float(self.pos[i,3])]
-			self.currpos_x.append(px)
-			self.currpos_z.append(pz)
+		self.currpos_x = self.pos[:,[0,2]]
+		self.currpos_z = self.pos[:,[1,3]]
+		return None
+
+	#Calculate link lengths and joint angles of proximal and distal joint at each finger position
+	#origin defaults to the finger's entry in FINGER_ORIGINS
+	def compute_joint_angles(self, finger_no, origin = None):
+		oX, oZ = FINGER_ORIGINS[finger_no] if origin is None else origin
+		self.prox_length, self.distal_length, self.prox_joint_angles, self.dist_joint_angles = joint_angles(self.pos, oX, oZ, mirrored = (finger_no == 1))
 		return None
 
 	#Calculate and plot joint angle of proximal and distal joint at each finger position
-	def joint_angle_calculation(self,finger_no):
-		#Joint angle calculation for finger 1 (left finger on the plot)
-		if finger_no == 1:
-			#Finger 1 origin position in x and z direction
-			oX = 0.024
-			oZ = 0.06
-			for i in xrange(len(self.currpos_x)):
-				self.prox_length = sqrt((self.currpos_x[i][0] - oX)**2 + (self.currpos_z[i][0] - oZ)**2)
-				self.distal_length = sqrt((self.currpos_x[i][1] - self.currpos_x[i][0])**2 + (self.currpos_z[i][1] - self.currpos_z[i][0])**2)
-				self.prox_joint_angles.append(np.arccos(abs(self.currpos_x[i][0]- oX) / self.prox_length))
-				self.dist_joint_angles.append(np.arccos(abs(self.currpos_x[i][1] - self.currpos_x[i][0]) / self.distal_length))
-
-		#Joint angle calculation for finger 2 (right finger on the plot)
-		elif finger_no == 2:
-			#Finger 2 origin position in x and z direction
-			oX = 0.05
-			oZ = 0.06
-			for i in xrange(len(self.currpos_x)):
-				self.prox_length = sqrt((self.currpos_x[i][0] - oX)**2 + (self.currpos_z[i][0] - oZ)**2)
-				self.distal_length = sqrt((self.currpos_x[i][1] - self.currpos_x[i][0])**2 + (self.currpos_z[i][1] - self.currpos_z[i][0])**2)
-				self.prox_joint_angles.append(np.arccos((self.currpos_x[i][0]- oX) / self.prox_length))
-				self.dist_joint_angles.append(np.arccos((self.currpos_x[i][1] - self.currpos_x[i][0]) / self.distal_length))
-
-		#Plot joint angles
-		t = np.arange(len(self.currpos_x))
-		plt.plot(t,self.prox_joint_angles)
-		plt.title('Finger {0} Proximal Joint Angles'.format(finger_no))
-		plt.xlabel('Time Step')
-		plt.ylabel('Joint Angles (Radian)')
-		plt.show()
-		plt.plot(t,self.dist_joint_angles)
-		plt.title('Finger {0} Distal Joint Angles'.format(finger_no))
-		plt.xlabel('Time Step')
-		plt.ylabel('Joint Angles (Radian)')		
-		plt.show()
+	def joint_angle_calculation(self,finger_no, origin = None, out = None):
+		self.compute_joint_angles(finger_no, origin)
+		self.plot_joint_angles(finger_no, out)
 		return None
 
+	#Plot proximal and distal joint angles over time
+	def plot_joint_angles(self, finger_no, out = None):
+		out = out or renderer()
+		t = np.arange(len(self.pos))
+		ax = out.axes()
+		ax.plot(*decimate(t, self.prox_joint_angles, out.max_points))
+		ax.set_title('Finger {0} Proximal Joint Angles'.format(finger_no))
+		ax.set_xlabel('Time Step')
+		ax.set_ylabel('Joint Angles (Radian)')
+		out.finish('finger{0}_proximal_joint_angles'.format(finger_no))
+		ax = out.axes()
+		ax.plot(*decimate(t, self.dist_joint_angles, out.max_points))
+		ax.set_title('Finger {0} Distal Joint Angles'.format(finger_no))
+		ax.set_xlabel('Time Step')
+		ax.set_ylabel('Joint Angles (Radian)')
+		out.finish('finger{0}_distal_joint_angles'.format(finger_no))
+		return None
+
+#Rows per chunk in streaming mode
+STREAM_CHUNK_ROWS = 65536
+
+#Columns of the streaming output file
+STREAM_COLUMNS = ['f1_prox_length', 'f1_distal_length', 'f1_prox_joint_angle', 'f1_dist_joint_angle', 'f2_prox_length', 'f2_distal_length', 'f2_prox_joint_angle', 'f2_dist_joint_angle']
+
+#Number of rows in a capture, read from its cache when there is one
+def count_capture_rows(filename):
+	data = cached_capture(filename)
+	if data is not None:
+		return len(data)
+	rows = 0
+	with open(filename, 'rb') as csvfile:
+		for line in csvfile:
+			if line.strip():
+				rows += 1
+	return rows
+
+#Yield a capture as float64 (rows, 8) chunks of about chunk_rows rows, slicing the cache when there is one
+def iter_capture_chunks(filename, chunk_rows = STREAM_CHUNK_ROWS):
+	data = cached_capture(filename)
+	if data is not None:
+		for start in range(0, len(data), chunk_rows):
+			yield data[start:start + chunk_rows]
+		return
+	with open(filename, 'rb') as csvfile:
+		while True:
+			#readlines() stops on a line boundary after about this many bytes
+			lines = csvfile.readlines(chunk_rows * CAPTURE_COLUMNS * 10)
+			if not lines:
+				break
+			yield parse_rows(b''.join(lines), filename)
+
+#Yield (first row index, positions, joint data) per chunk, joint data columns as in STREAM_COLUMNS
+def iter_joint_angles(filename, chunk_rows = STREAM_CHUNK_ROWS, origins = FINGER_ORIGINS):
+	start = 0
+	for chunk in iter_capture_chunks(filename, chunk_rows):
+		f1 = joint_angles(chunk[:,0:4], origins[1][0], origins[1][1], mirrored = True)
+		f2 = joint_angles(chunk[:,4:], origins[2][0], origins[2][1])
+		yield start, chunk, np.column_stack(f1 + f2)
+		start += len(chunk)
+
+#Rows of a capture at the given sample indices as a (len(indices), 8) array, reading no further than the largest one
+def capture_rows(filename, indices, chunk_rows = STREAM_CHUNK_ROWS):
+	indices = np.asarray(indices, dtype=np.int64)
+	rows = np.zeros((len(indices), CAPTURE_COLUMNS))
+	start = 0
+	for chunk in iter_capture_chunks(filename, chunk_rows):
+		stop = start + len(chunk)
+		inside = (indices >= start) & (indices < stop)
+		rows[inside] = chunk[indices[inside] - start]
+		start = stop
+		if start > indices.max():
+			break
+	return rows
+
+#Columns of the joint angles in the streaming output, in trial_angles order
+STREAM_ANGLE_COLUMNS = [STREAM_COLUMNS.index(name) for name in ['f1_prox_joint_angle', 'f1_dist_joint_angle', 'f2_prox_joint_angle', 'f2_dist_joint_angle']]
+
+#Compute joint angles of a capture chunk by chunk into an (N, 8) .npy file at out_path (columns in STREAM_COLUMNS)
+#Grasp phases are segmented chunk by chunk on the way, only the Grasp Setup, Pre-Grasp and Final Grasp frames are
+#returned as {name: (sample index, positions, joint data)}
+def stream_joint_angles(filename, out_path, chunk_rows = STREAM_CHUNK_ROWS, origins = FINGER_ORIGINS):
+	rows = count_capture_rows(filename)
+	if rows == 0:
+		raise ValueError("{0} has no samples".format(filename))
+	carry = None
+	starts = []
+	stops = []
+	out = np.lib.format.open_memmap(out_path, mode = 'w+', dtype = np.float64, shape = (rows, len(STREAM_COLUMNS)))
+	for start, chunk, joints in iter_joint_angles(filename, chunk_rows, origins):
+		stop = start + len(chunk)
+		if stop > rows:
+			raise ValueError("{0} changed while it was being read".format(filename))
+		out[start:stop] = joints
+		flags, carry = moving_flags(joints[:,STREAM_ANGLE_COLUMNS], carry)
+		run_starts, run_stops = flag_runs(flags, start)
+		starts.append(run_starts)
+		stops.append(run_stops)
+	#A movement that runs over a chunk boundary ends and starts again there, phases_from_runs joins it back up
+	bounds, frames = phases_from_runs(np.concatenate(starts), np.concatenate(stops), rows)
+	positions = capture_rows(filename, frames, chunk_rows)
+	snapshots = {}
+	for i, name in enumerate(PHASE_NAMES):
+		snapshots[name] = (frames[i], positions[i], np.array(out[frames[i]]))
+	out.flush()
+	del out
+	return snapshots
+
+#Most points drawn per series, longer series are decimated to about two points per pixel column
+PLOT_MAX_POINTS = 2000
+
+#Decimate a time series to at most max_points points, keeping the min and max sample of every bucket so peaks survive
+def decimate(t, y, max_points = PLOT_MAX_POINTS):
+	y = np.asarray(y)
+	n = len(y)
+	if n <= max_points:
+		return t, y
+	buckets = max_points // 2
+	size = n // buckets
+	blocks = y[:buckets * size].reshape(buckets, size)
+	base = np.arange(buckets) * size
+	index = np.unique(np.concatenate([base + blocks.argmin(axis = 1), base + blocks.argmax(axis = 1), [n - 1]]))
+	return np.asarray(t)[index], y[index]
+
+#Evenly spaced sample indices (at most max_points) for decimating x-z trajectories
+def trajectory_index(n, max_points = PLOT_MAX_POINTS):
+	if n <= max_points:
+		return slice(None)
+	return np.linspace(0, n - 1, max_points).astype(int)
+
+#Where figures go: interactive pyplot windows (outdir None) or image files in outdir
+#File output draws every plot on one reused Agg Figure, so no GUI backend or display is needed
+class renderer():
+	def __init__(self, outdir = None, fmt = 'png', prefix = '', max_points = PLOT_MAX_POINTS):
+		self.outdir = outdir
+		self.fmt = fmt
+		self.prefix = prefix
+		self.max_points = max_points
+		self.figure = None
+		self.saved = []
+		if outdir is not None:
+			if not os.path.isdir(outdir):
+				os.makedirs(outdir)
+			self.figure = Figure(figsize = (8, 6))
+			FigureCanvasAgg(self.figure)
+
+	#Fresh axes for the next plot
+	def axes(self):
+		if self.figure is None:
+			return plt.figure().gca()
+		self.figure.clf()
+		return self.figure.add_subplot(111)
+
+	#Show the plot, or save it as <prefix><name>.<fmt> and return the path
+	def finish(self, name):
+		if self.figure is None:
+			plt.show()
+			return None
+		path = os.path.join(self.outdir, '{0}{1}.{2}'.format(self.prefix, name, self.fmt))
+		self.figure.savefig(path)
+		self.saved.append(path)
+		return path
+
+#Unit link lengths and hand base of the schematic grasp plot
+SCHEMATIC_LENGTHS = [1.0, 1.0, 1.0, 1.0]
+SCHEMATIC_ORIGINS = {1: (-1.0, 0.0), 2: (1.0, 0.0)}
+
 #Plot grasp position by using calculated joint angles of proximal and distal joint of each finger
-def plot_grasp_using_joint_angles(f1_prox_joint_angle, f1_dist_joint_angle, f2_prox_joint_angle, f2_dist_joint_angle, status_of_grasp):
-	f1x = [-1, -1+1*np.cos(pi - f1_prox_joint_angle), -1+1*np.cos(pi - f1_prox_joint_angle)+1*np.cos(pi-f1_dist_joint_angle)]
-	f1z = [0, 1*np.sin(pi - f1_prox_joint_angle), 1*np.sin(pi-f1_prox_joint_angle)+1*np.sin(pi-f1_dist_joint_angle)]
-	f2x = [1, 1+1*np.cos(f2_prox_joint_angle), 1+1*np.cos(f2_prox_joint_angle)+1*np.cos(f2_dist_joint_angle)]
-	f2z = [0, 1*np.sin(f2_prox_joint_angle), 1*np.sin(f2_prox_joint_angle)+1*np.sin(f2_dist_joint_angle)]
-
-	plt.plot([-1,1],[0,0], 'b--', f1x, f1z, 'r', f2x, f2z, 'k')
-	plt.title('Status of grasp: {0}'.format(status_of_grasp))
-	plt.ylim(-1, 2)
-	plt.xlim(-2.5, 3)
-	plt.legend(['Hand Base', 'Finger 1', 'Finger 2'])
-	plt.xlabel('X-axis')
-	plt.ylabel('Z-axis')			
-	plt.show()
-	return None			
+#Without lengths the fingers are drawn as unit links on a schematic base, with lengths (f1 proximal, f1 distal,
+#f2 proximal, f2 distal, e.g. link_lengths()) to scale from the measured finger origins
+def plot_grasp_using_joint_angles(f1_prox_joint_angle, f1_dist_joint_angle, f2_prox_joint_angle, f2_dist_joint_angle, status_of_grasp, out = None, lengths = None):
+	out = out or renderer()
+	origins = SCHEMATIC_ORIGINS if lengths is None else FINGER_ORIGINS
+	pos = grasp_forward_kinematics([f1_prox_joint_angle, f1_dist_joint_angle, f2_prox_joint_angle, f2_dist_joint_angle], SCHEMATIC_LENGTHS if lengths is None else lengths, origins)[0]
+	f1x = [origins[1][0], pos[0], pos[2]]
+	f1z = [origins[1][1], pos[1], pos[3]]
+	f2x = [origins[2][0], pos[4], pos[6]]
+	f2z = [origins[2][1], pos[5], pos[7]]
+
+	ax = out.axes()
+	ax.plot([origins[1][0], origins[2][0]], [origins[1][1], origins[2][1]], 'b--', f1x, f1z, 'r', f2x, f2z, 'k')
+	ax.set_title('Status of grasp: {0}'.format(status_of_grasp))
+	if lengths is None:
+		ax.set_ylim(-1, 2)
+		ax.set_xlim(-2.5, 3)
+	else:
+		ax.set_aspect('equal', 'datalim')
+	ax.legend(['Hand Base', 'Finger 1', 'Finger 2'])
+	ax.set_xlabel('X-axis')
+	ax.set_ylabel('Z-axis')
+	out.finish('grasp_' + status_of_grasp.split(' (')[0].lower().replace(' ', '_').replace('-', '_'))
+	return None
 
 #Plot proximal and distal joint trajectory of each finger 
-def plot_traj_(f1_prox_x, f1_prox_z, f1_dist_x, f1_dist_z, f2_prox_x, f2_prox_z, f2_dist_x, f2_dist_z):
-	plt.plot(f1_prox_x, f1_prox_z, f1_dist_x, f1_dist_z, f2_prox_x, f2_prox_z, f2_dist_x, f2_dist_z)
-	plt.title('Finger Joint Trajectory')
-	plt.legend(['finger 1 proximal joint', 'finger 1 distal joint', 'finger 2 proximal joint', 'finger 2 distal joint'])
-	plt.xlabel('X-axis')
-	plt.ylabel('Z-axis')
-	plt.show()
+def plot_traj_(f1_prox_x, f1_prox_z, f1_dist_x, f1_dist_z, f2_prox_x, f2_prox_z, f2_dist_x, f2_dist_z, out = None):
+	out = out or renderer()
+	index = trajectory_index(len(f1_prox_x), out.max_points)
+	ax = out.axes()
+	ax.plot(*[np.asarray(series)[index] for series in (f1_prox_x, f1_prox_z, f1_dist_x, f1_dist_z, f2_prox_x, f2_prox_z, f2_dist_x, f2_dist_z)])
+	ax.set_title('Finger Joint Trajectory')
+	ax.legend(['finger 1 proximal joint', 'finger 1 distal joint', 'finger 2 proximal joint', 'finger 2 distal joint'])
+	ax.set_xlabel('X-axis')
+	ax.set_ylabel('Z-axis')
+	out.finish('joint_trajectory')
 	return None
 
+#Plot three grasp position (Grasp Setup, Pre-Grasp, Final Grasp) with raw joint position data
+#frames are the sample of each phase (default: first, middle and last sample)
+def plot_grasp_positions(f1, f2, out = None, frames = None):
+	out = out or renderer()
+	frames = frames or [0, len(f1.pos)//2, -1]
+	lines = []
+	for frame, style1, style2 in zip(frames, ['r', 'r--', 'r-'], ['k', 'k--.', 'k-']):
+		for f, origin, style in [(f1, FINGER_ORIGINS[1], style1), (f2, FINGER_ORIGINS[2], style2)]:
+			lines += [[origin[0], f.pos[frame,0], f.pos[frame,2]], [origin[1], f.pos[frame,1], f.pos[frame,3]], style]
+	ax = out.axes()
+	ax.plot([FINGER_ORIGINS[1][0], FINGER_ORIGINS[2][0]], [FINGER_ORIGINS[1][1], FINGER_ORIGINS[2][1]], 'b--', *lines)
+	ax.set_title('Grasp Position with raw finger data')
+	ax.legend(['Hand Base', 'finger 1 setup', 'finger 2 setup', 'finger 1 pre grasp', 'finger 2 pre grasp', 'finger 1 final grasp', 'finger 2 final grasp'])
+	ax.set_xlabel('X-axis')
+	ax.set_ylabel('Z-axis')
+	out.finish('grasp_position_raw')
+	return None
+
+#Every figure of one trial, fingers must have their joint angles computed
+#The three grasp positions are drawn at the representative frames of the segmented grasp phases
+def plot_trial(f1, f2, out = None):
+	out = out or renderer()
+	frames = segment_phases(trial_angles(f1, f2))[1]
+	lengths = link_lengths(f1, f2)
+
+	#Seperate proximal and distal joint position of finger 1 and 2
+	for f in (f1, f2):
+		f.proximal_pos()
+		f.distal_pos()
+		f.finger_pos()
+
+	#Plot proximal and distal joint trajectory of finger 1 and 2 
+	plot_traj_(f1.proximal_x,f1.proximal_z,f1.distal_x,f1.distal_z,f2.proximal_x, f2.proximal_z, f2.distal_x, f2.distal_z, out)
+
+	#Plot joint angles for each finger
+	f1.plot_joint_angles(1, out)
+	f2.plot_joint_angles(2, out)
+
+	#Plot three grasp position with joint position data
+	plot_grasp_positions(f1, f2, out, frames)
+
+	#Plot three grasp position using joint angles of proximal and distal joint of finger 1 and 2
+	for name, frame in zip(['Grasp Setup', 'Pre-Grasp', 'Final Grasp (Grasping Object)'], frames):
+		plot_grasp_using_joint_angles(f1.prox_joint_angles[frame], f1.dist_joint_angles[frame], f2.prox_joint_angles[frame], f2.dist_joint_angles[frame], name, out, lengths)
+	return out.saved
+
+#Most frames of a grasp animation, longer trials are sampled evenly
+ANIMATION_MAX_FRAMES = 300
+
+#Matplotlib movie writer for each animation file type
+ANIMATION_WRITERS = {'.gif': 'pillow', '.html': 'html', '.mp4': 'ffmpeg'}
+
+#Animate a trial into path (.gif, .html or .mp4): both fingers reconstructed from their joint angles and the trial's
+#link lengths, over the raw marker positions
+#Every frame is computed up front with grasp_forward_kinematics, drawing a frame only moves the lines to its row
+def animate_grasp(f1, f2, path, fps = 30, max_frames = ANIMATION_MAX_FRAMES, origins = FINGER_ORIGINS):
+	angles = trial_angles(f1, f2)
+	samples = np.arange(len(angles))[trajectory_index(len(angles), max_frames)]
+	pos = grasp_forward_kinematics(angles[samples], link_lengths(f1, f2), origins)
+	raw = np.hstack([f1.pos, f2.pos])[samples]
+	bounds = segment_phases(angles)[0]
+	phases = np.searchsorted([start for start, stop in bounds[1:]], samples, side = 'right')
+	f1x = np.column_stack([np.full(len(pos), origins[1][0]), pos[:,0], pos[:,2]])
+	f1z = np.column_stack([np.full(len(pos), origins[1][1]), pos[:,1], pos[:,3]])
+	f2x = np.column_stack([np.full(len(pos), origins[2][0]), pos[:,4], pos[:,6]])
+	f2z = np.column_stack([np.full(len(pos), origins[2][1]), pos[:,5], pos[:,7]])
+
+	figure = Figure(figsize = (8, 6))
+	FigureCanvasAgg(figure)
+	ax = figure.add_subplot(111)
+	ax.plot([origins[1][0], origins[2][0]], [origins[1][1], origins[2][1]], 'b--')
+	line1, = ax.plot([], [], 'r')
+	line2, = ax.plot([], [], 'k')
+	markers, = ax.plot([], [], 'g.')
+	x = np.concatenate([f1x.ravel(), f2x.ravel(), raw[:,0::2].ravel()])
+	z = np.concatenate([f1z.ravel(), f2z.ravel(), raw[:,1::2].ravel()])
+	ax.set_xlim(x.min() - 0.01, x.max() + 0.01)
+	ax.set_ylim(z.min() - 0.01, z.max() + 0.01)
+	ax.set_aspect('equal')
+	ax.legend(['Hand Base', 'Finger 1', 'Finger 2', 'Raw markers'])
+	ax.set_xlabel('X-axis')
+	ax.set_ylabel('Z-axis')
+	title = ax.set_title('')
+
+	#One draw per frame straight into the writer (FuncAnimation would draw every frame twice)
+	writer = animation.writers[ANIMATION_WRITERS.get(os.path.splitext(path)[1].lower(), 'ffmpeg')](fps = fps)
+	with writer.saving(figure, path, figure.dpi):
+		for i in range(len(pos)):
+			line1.set_data(f1x[i], f1z[i])
+			line2.set_data(f2x[i], f2z[i])
+			markers.set_data(raw[i,0::2], raw[i,1::2])
+			title.set_text('Sample {0}: {1}'.format(samples[i], PHASE_NAMES[phases[i]]))
+			writer.grab_frame()
+	return path
+
+#Value following a command line option, or default when the option is not given
+def option_value(name, default = None):
+	if name in sys.argv[:-1]:
+		return sys.argv[sys.argv.index(name) + 1]
+	return default
+
+#Per-finger quantities stored in a results file, each becomes a column f<finger number>_<quantity>
+RESULT_QUANTITIES = ['prox_joint_angles', 'dist_joint_angles', 'prox_length', 'distal_length', 'proximal_x', 'proximal_z', 'distal_x', 'distal_z']
+
+#Save the computed joint data of a trial as a compressed .npz, one float64 column per finger quantity
+#plus a json metadata entry (source file, finger origins, sample count, column names)
+def save_results(path, f1, f2, source, origins = FINGER_ORIGINS):
+	columns = {}
+	for finger_no, f in [(1, f1), (2, f2)]:
+		f.proximal_pos()
+		f.distal_pos()
+		for quantity in RESULT_QUANTITIES:
+			columns['f{0}_{1}'.format(finger_no, quantity)] = np.asarray(getattr(f, quantity), dtype = np.float64)
+	meta = {'source': os.path.abspath(source), 'samples': len(f1.pos), 'origins': dict((str(k), list(v)) for k, v in origins.items()), 'columns': sorted(columns)}
+	np.savez_compressed(path, meta = np.array(json.dumps(meta)), **columns)
+	return None
+
+#Read a results file: returns (metadata, {column: array}) with only the requested columns (default all)
+#read and decompressed, the rest of the file is not touched
+def load_results(path, columns = None):
+	with np.load(path) as data:
+		meta = json.loads(data['meta'].item())
+		return meta, dict((column, data[column]) for column in (columns or meta['columns']))
+
+#Columns of the batch summary table
+SUMMARY_COLUMNS = ['file', 'samples',
+	'f1_prox_min', 'f1_prox_max', 'f1_prox_final', 'f1_dist_min', 'f1_dist_max', 'f1_dist_final',
+	'f2_prox_min', 'f2_prox_max', 'f2_prox_final', 'f2_dist_min', 'f2_dist_max', 'f2_dist_final',
+	'pre_grasp_start', 'final_grasp_start', 'pre_grasp_frame', 'fk_rms_error', 'fk_max_error',
+	'load_s', 'compute_s', 'total_s', 'error']
+
+#Joint-angle summary of one capture (angle ranges, final grasp angles, sample count, timing)
+#Runs in a batch worker process, a capture that fails to load is reported in the error column
+#With plot_dir every figure of the trial is rendered to files named after the capture, otherwise nothing is plotted
+#With results_dir the joint data is saved there as <capture name>.npz
+def analyze_trial(filename, plot_dir = None, fmt = 'png', results_dir = None):
+	summary = dict((column, '') for column in SUMMARY_COLUMNS)
+	summary['file'] = filename
+	start = time.time()
+	try:
+		all_pos = load_capture(filename)
+		loaded = time.time()
+		f1 = finger(all_pos[:,0:4])
+		f2 = finger(all_pos[:,4:])
+		f1.compute_joint_angles(1)
+		f2.compute_joint_angles(2)
+		summary['samples'] = len(all_pos)
+		for name, angles in [('f1_prox', f1.prox_joint_angles), ('f1_dist', f1.dist_joint_angles), ('f2_prox', f2.prox_joint_angles), ('f2_dist', f2.dist_joint_angles)]:
+			summary[name + '_min'] = float(angles.min())
+			summary[name + '_max'] = float(angles.max())
+			summary[name + '_final'] = float(angles[-1])
+		bounds, frames = segment_phases(trial_angles(f1, f2))
+		summary['pre_grasp_start'] = bounds[1][0]
+		summary['final_grasp_start'] = bounds[2][0]
+		summary['pre_grasp_frame'] = frames[1]
+		#Reconstruction of the raw markers from the joint angles and the trial's link lengths, in metres
+		#Link directions the angles cannot represent are folded out, so this measures how rigid the marked links stay
+		errors = reconstruction_error(all_pos, grasp_forward_kinematics(trial_angles(f1, f2), link_lengths(f1, f2)))
+		summary['fk_rms_error'] = float(np.sqrt(np.mean(errors * errors)))
+		summary['fk_max_error'] = float(errors.max())
+		summary['load_s'] = loaded - start
+		summary['compute_s'] = time.time() - loaded
+		name = os.path.splitext(os.path.basename(filename))[0]
+		if results_dir is not None:
+			save_results(os.path.join(results_dir, name + '.npz'), f1, f2, filename)
+		if plot_dir is not None:
+			plot_trial(f1, f2, renderer(plot_dir, fmt, prefix = name + '_'))
+	except (IOError, OSError, ValueError, IndexError) as e:
+		summary['error'] = str(e)
+	summary['total_s'] = time.time() - start
+	return summary
+
+#Capture files of a directory (every .csv in it) or a glob pattern, sorted
+def expand_captures(pattern):
+	if os.path.isdir(pattern):
+		pattern = os.path.join(pattern, '*.csv')
+	return sorted(glob.glob(pattern))
+
+#func over items on a pool of worker processes (in this process for a single item), results in item order
+def map_pool(func, items, workers = None):
+	if len(items) == 1:
+		return [func(items[0])]
+	workers = workers or multiprocessing.cpu_count()
+	if ProcessPoolExecutor is not None:
+		with ProcessPoolExecutor(max_workers = workers) as pool:
+			return list(pool.map(func, items))
+	pool = multiprocessing.Pool(workers)
+	try:
+		return pool.map(func, items)
+	finally:
+		pool.close()
+		pool.join()
+
+#Analyze every file on a pool of worker processes, returning summaries in file order
+def run_batch(files, workers = None, plot_dir = None, fmt = 'png', results_dir = None):
+	if results_dir is not None and not os.path.isdir(results_dir):
+		os.makedirs(results_dir)
+	return map_pool(functools.partial(analyze_trial, plot_dir = plot_dir, fmt = fmt, results_dir = results_dir), files, workers)
+
+#Write the batch summary table as csv
+def write_summary(summaries, out_path):
+	with open(out_path, 'w') as f:
+		writer = csv.DictWriter(f, fieldnames = SUMMARY_COLUMNS)
+		writer.writeheader()
+		for summary in summaries:
+			writer.writerow(summary)
+	return None
+
+#Batch mode command line: python grasp_analysis.py --batch captures/ [--workers N] [--out summary.csv]
+def batch_main(argv):
+	parser = argparse.ArgumentParser(prog = 'grasp_analysis.py --batch', description = 'Analyze many captures in parallel without plotting')
+	parser.add_argument('captures', help = 'directory of csv captures or a glob pattern')
+	parser.add_argument('--workers', type = int, default = None, help = 'worker processes (default: number of cores)')
+	parser.add_argument('--out', default = 'grasp_summary.csv', help = 'summary table csv')
+	parser.add_argument('--plots', default = None, help = 'also render every figure of every trial into this directory')
+	parser.add_argument('--format', default = 'png', choices = ['png', 'svg'], help = 'figure file format')
+	parser.add_argument('--results', default = None, help = 'save the joint data of every trial into this directory as <capture name>.npz')
+	args = parser.parse_args(argv)
+
+	files = expand_captures(args.captures)
+	if not files:
+		sys.exit("No csv file detected")
+	start = time.time()
+	summaries = run_batch(files, args.workers, args.plots, args.format, args.results)
+	elapsed = time.time() - start
+	write_summary(summaries, args.out)
+
+	for summary in summaries:
+		if summary['error']:
+			print('{0}: FAILED ({1})'.format(summary['file'], summary['error']))
+		else:
+			print('{0}: {1} samples, final angles f1 {2:.3f}/{3:.3f} f2 {4:.3f}/{5:.3f} rad, {6:.3f} s'.format(summary['file'], summary['samples'], summary['f1_prox_final'], summary['f1_dist_final'], summary['f2_prox_final'], summary['f2_dist_final'], summary['total_s']))
+	print('{0} captures in {1:.2f} s, summary written to {2}'.format(len(files), elapsed, args.out))
+	return None
 
 if __name__ == '__main__':
+	#Streaming mode for captures that do not fit in memory -> python grasp_analysis.py --stream capture.csv angles.npy
+	if sys.argv[1:2] == ['--stream']:
+		if len(sys.argv) < 4:
+			sys.exit("Usage: python grasp_analysis.py --stream capture.csv angles.npy")
+		snapshots = stream_joint_angles(sys.argv[2], sys.argv[3])
+		out = renderer(option_value('--output'), option_value('--format', 'png')) if option_value('--output') else renderer()
+		for name in PHASE_NAMES:
+			frame, positions, joints = snapshots[name]
+			print('{0} (sample {1}): finger 1 {2:.4f} {3:.4f}  finger 2 {4:.4f} {5:.4f} (proximal, distal rad)'.format(name, frame, joints[2], joints[3], joints[6], joints[7]))
+			plot_grasp_using_joint_angles(joints[2], joints[3], joints[6], joints[7], name, out, joints[[0, 1, 4, 5]])
+		sys.exit(0)
+
+	#Batch mode
+	if sys.argv[1:2] == ['--batch']:
+		batch_main(sys.argv[2:])
+		sys.exit(0)
+
 	#Read and take argument from command line
 	filename = check_argument()
 
+	#Figures go to windows, or to files with --output DIR [--format png|svg]
+	out = renderer(option_value('--output'), option_value('--format', 'png'), prefix = os.path.splitext(os.path.basename(filename))[0] + '_') if option_value('--output') else renderer()
+
 	#Open and Read csv file of joint position data
 	all_pos = open_csv_to_list(filename)
 
-	#Store first four column of joint position for finger 1, the last four column for finger 2
-	f1_pos = []
-	f2_pos = []
-	for i in xrange(len(all_pos)):
-		f1_pos.append(all_pos[i,0:4])
-		f2_pos.append(all_pos[i,4:])
-	f1_pos_np = np.array(f1_pos)
-	f2_pos_np = np.array(f2_pos)
-
-	#Create finger class for finger 1 and 2
-	f1 = finger(f1_pos_np)
-	f2 = finger(f2_pos_np)
-
-	#Seperate proximal and distal joint position of finger 1
-	f1.proximal_pos()
-	f1.distal_pos()
-	#Seperate proximal and distal joint position of finger 2
-	f2.proximal_pos()
-	f2.distal_pos()
-
-	#Plot proximal and distal joint trajectory of finger 1 and 2 
-	plot_traj_(f1.proximal_x,f1.proximal_z,f1.distal_x,f1.distal_z,f2.proximal_x, f2.proximal_z, f2.distal_x, f2.distal_z)
-
-	#Store finger position of finger 1 and 2
-	f1.finger_pos()
-	f2.finger_pos()
+	#Create finger class for finger 1 (first four columns of joint position) and 2 (last four columns)
+	f1 = finger(all_pos[:,0:4])
+	f2 = finger(all_pos[:,4:])
 
 	#Calculate joint angles for each finger
-	f1.joint_angle_calculation(1)
-	f2.joint_angle_calculation(2)
+	f1.compute_joint_angles(1)
+	f2.compute_joint_angles(2)
 
-	#Plot three grasp position with joint position data
-	#Finger 1 (Grasp Steup, Pre-Grasp, Final Grasp)
-	f1x = [0.024, f1.currpos_x[0][0], f1.currpos_x[0][1]]
-	f1z = [0.06, f1.currpos_z[0][0], f1.currpos_z[0][1]]
-	f11x = [0.024, f1.currpos_x[len(f1.currpos_x)/2][0], f1.currpos_x[len(f1.currpos_x)/2][1]]
-	f11z = [0.06, f1.currpos_z[len(f1.currpos_z)/2][0], f1.currpos_z[len(f1.currpos_z)/2][1]]
-	f111x = [0.024, f1.currpos_x[-1][0], f1.currpos_x[-1][1]]
-	f111z = [0.06, f1.currpos_z[-1][0], f1.currpos_z[-1][1]]
-
-	#Finger 2 (Grasp Steup, Pre-Grasp, Final Grasp)
-	f2x = [0.05, f2.currpos_x[0][0], f2.currpos_x[0][1]]
-	f2z = [0.06, f2.currpos_z[0][0], f2.currpos_z[0][1]]
-	f22x = [0.05, f2.currpos_x[len(f2.currpos_x)/2][0], f2.currpos_x[len(f2.currpos_x)/2][1]]
-	f22z = [0.06, f2.currpos_z[len(f1.currpos_z)/2][0], f2.currpos_z[len(f2.currpos_z)/2][1]]
-	f222x = [0.05, f2.currpos_x[-1][0], f2.currpos_x[-1][1]]
-	f222z = [0.06, f2.currpos_z[-1][0], f2.currpos_z[-1][1]]
-
-	plt.plot([0.024,0.05], [0.06,0.06],'b--',f1x,f1z,'r',f2x,f2z,'k',f11x,f11z,'r--',f22x,f22z,'k--.',f111x,f111z,'r-',f222x,f222z,'k-')
-	plt.title('Grasp Position with raw finger data')
-	plt.legend(['Hand Base', 'finger 1 setup', 'finger 2 setup', 'finger 1 pre grasp', 'finger 2 pre grasp', 'finger 1 final grasp', 'finger 2 final grasp'])
-	plt.xlabel('X-axis')
-	plt.ylabel('Z-axis')
-	plt.show()
-
-	#Plot three grasp position using joint angles of proximal and distal joint of finger 1 and 2
-	#Grasp Setup
-	plot_grasp_using_joint_angles(f1.prox_joint_angles[0], f1.dist_joint_angles[0], f2.prox_joint_angles[0], f2.dist_joint_angles[0], 'Grasp Setup')
-	#Pre-grasp
-	plot_grasp_using_joint_angles(f1.prox_joint_angles[len(f1.dist_joint_angles)/2], f1.dist_joint_angles[len(f1.dist_joint_angles)/2], f2.prox_joint_angles[len(f1.dist_joint_angles)/2], f2.dist_joint_angles[len(f1.dist_joint_angles)/2], 'Pre-Grasp')
-	#Final grasp
-	plot_grasp_using_joint_angles(f1.prox_joint_angles[-1], f1.dist_joint_angles[-1], f2.prox_joint_angles[-1], f2.dist_joint_angles[-1], 'Final Grasp (Grasping Object)')
+	#Keep the results with --results PATH.npz
+	if option_value('--results'):
+		save_results(option_value('--results'), f1, f2, filename)
 
+	#Plot joint trajectories, joint angles and the three grasp positions
+	saved = plot_trial(f1, f2, out)
+	for path in saved:
+		print(path)
 
+	#Animate the reconstructed grasp with --animate PATH (.gif, .html or .mp4)
+	if option_value('--animate'):
+		print(animate_grasp(f1, f2, option_value('--animate')))
@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+
+#######################################################################################
+#Benchmark and regression check of the grasp_analysis pipeline
+#Times the three stages of a trial separately: load (csv parse), angles (link lengths and joint angles of both fingers)
+#and render (every figure of plot_trial to png files), and records the peak memory of each stage
+#Peak memory is what tracemalloc sees allocated during the stage (numpy arrays included), on Python 2 it is the
+#process high-water mark from resource, which only ever grows
+#Captures: the bundled cy_grasp/palm/pinch data plus synthetic captures of the requested sizes, made by stretching
+#cy_grasp_data.csv to that many rows and adding marker noise
+#The joint data of the bundled captures is compared with the golden values in grasp_golden.json
+#Run the benchmark -> python grasp_benchmark.py [--sizes 100000 1000000] [--repeat 3] [--no-render] [--json results.json]
+#Rewrite the golden values after an intended change of results -> python grasp_benchmark.py --update-golden
+
+#######################################################################################
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+import numpy as np
+
+try:
+	import tracemalloc
+except ImportError:
+	tracemalloc = None
+	try:
+		import resource
+	except ImportError:
+		resource = None
+
+import grasp_analysis as grasp
+from openhand_telemetry import clock
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+#Bundled captures, benchmarked and checked against the golden values
+BUNDLED_CAPTURES = [os.path.join(HERE, name) for name in ['cy_grasp_data.csv', 'cy_palm_data.csv', 'cy_pinch_data.csv']]
+
+#Golden joint data of the bundled captures
+GOLDEN_PATH = os.path.join(HERE, 'grasp_golden.json')
+
+#Evenly spaced samples of every quantity kept in the golden file (plus its sum, min and max)
+GOLDEN_POINTS = 16
+
+#Relative tolerance of the golden check, results may move by a few ulp between numpy versions
+GOLDEN_RTOL = 1e-10
+
+#Rows of the synthetic captures benchmarked by default
+SYNTHETIC_SIZES = [100000, 1000000]
+
+#Standard deviation of the marker noise added to synthetic captures, in metres
+SYNTHETIC_NOISE = 2e-5
+
+#Write a synthetic capture of rows samples: the source capture stretched in time to that length plus marker noise
+def make_synthetic(path, rows, source = BUNDLED_CAPTURES[0], noise = SYNTHETIC_NOISE, seed = 0):
+	pos = grasp.load_capture(source, cache = False)
+	t = np.linspace(0, len(pos) - 1, rows)
+	data = np.column_stack([np.interp(t, np.arange(len(pos)), pos[:,column]) for column in range(grasp.CAPTURE_COLUMNS)])
+	data += np.random.RandomState(seed).normal(0.0, noise, data.shape)
+	np.savetxt(path, data, fmt = '%.6f', delimiter = ',')
+	return path
+
+#Run func(*args) once and return (result, peak bytes)
+def peak_memory(func, *args):
+	if tracemalloc is not None:
+		tracemalloc.start()
+		try:
+			result = func(*args)
+			peak = tracemalloc.get_traced_memory()[1]
+		finally:
+			tracemalloc.stop()
+		return result, peak
+	result = func(*args)
+	#ru_maxrss is in kilobytes on Linux
+	peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 if resource is not None else float('nan')
+	return result, peak
+
+#Shortest time of repeat runs of func(*args), apart from the traced run of peak_memory (tracemalloc slows down every
+#allocation, matplotlib rendering about four times)
+def best_time(func, args, repeat):
+	best = float('inf')
+	for i in range(repeat):
+		start = clock()
+		func(*args)
+		best = min(best, clock() - start)
+	return best
+
+def load_stage(path):
+	return grasp.load_capture(path, cache = False)
+
+def angles_stage(pos):
+	f1 = grasp.finger(pos[:,0:4])
+	f2 = grasp.finger(pos[:,4:])
+	f1.compute_joint_angles(1)
+	f2.compute_joint_angles(2)
+	return f1, f2
+
+def render_stage(fingers, outdir):
+	return grasp.plot_trial(fingers[0], fingers[1], grasp.renderer(outdir, 'png'))
+
+#Benchmark one capture, returns one result dict per stage and the fingers of the trial
+def benchmark_capture(path, repeat = 3, render = True, outdir = None):
+	results = []
+	pos, peak = peak_memory(load_stage, path)
+	results.append(('load', best_time(load_stage, (path,), repeat), peak))
+	fingers, peak = peak_memory(angles_stage, pos)
+	results.append(('angles', best_time(angles_stage, (pos,), repeat), peak))
+	if render:
+		saved, peak = peak_memory(render_stage, fingers, outdir)
+		#Rendering is slow and its time barely varies, one run is enough
+		results.append(('render', best_time(render_stage, (fingers, outdir), 1), peak))
+	name = os.path.basename(path)
+	return [{'capture': name, 'rows': len(pos), 'stage': stage, 'seconds': seconds, 'rows_per_s': len(pos) / seconds if seconds > 0 else float('inf'), 'peak_mb': peak / 1e6} for stage, seconds, peak in results], fingers
+
+#Golden quantities of a trial: link lengths and joint angles of both fingers
+def golden_quantities(f1, f2):
+	quantities = {}
+	for no, f in [(1, f1), (2, f2)]:
+		for name in ['prox_length', 'distal_length', 'prox_joint_angles', 'dist_joint_angles']:
+			quantities['f{0}_{1}'.format(no, name)] = np.asarray(getattr(f, name), dtype = np.float64)
+	return quantities
+
+#Sum, min, max and GOLDEN_POINTS evenly spaced samples of every golden quantity
+def golden_values(f1, f2, points = GOLDEN_POINTS):
+	values = {}
+	for name, data in golden_quantities(f1, f2).items():
+		index = np.linspace(0, len(data) - 1, points).astype(int)
+		values[name] = {'samples': len(data), 'sum': float(data.sum()), 'min': float(data.min()), 'max': float(data.max()), 'points': data[index].tolist()}
+	return values
+
+#Differences between the golden values of a capture and the current ones, as printable lines (empty when they match)
+def compare_golden(expected, actual, rtol = GOLDEN_RTOL):
+	problems = []
+	for name in sorted(expected):
+		if name not in actual:
+			problems.append('{0}: missing'.format(name))
+			continue
+		if expected[name]['samples'] != actual[name]['samples']:
+			problems.append('{0}: {1} samples, golden {2}'.format(name, actual[name]['samples'], expected[name]['samples']))
+			continue
+		for key in ['sum', 'min', 'max', 'points']:
+			want = np.asarray(expected[name][key])
+			got = np.asarray(actual[name][key])
+			if not np.allclose(got, want, rtol = rtol, atol = 0.0):
+				worst = np.max(np.abs(got - want) / np.maximum(np.abs(want), 1e-300))
+				problems.append('{0} {1}: relative difference {2:.3g} (tolerance {3:.3g})'.format(name, key, worst, rtol))
+	return problems
+
+def load_golden(path = GOLDEN_PATH):
+	with open(path) as f:
+		return json.load(f)
+
+def save_golden(golden, path = GOLDEN_PATH):
+	with open(path, 'w') as f:
+		json.dump(golden, f, indent = 1, sort_keys = True)
+		f.write('\n')
+	return None
+
+def print_results(results):
+	print('{0:<28} {1:>10} {2:>8} {3:>12} {4:>14} {5:>10}'.format('capture', 'rows', 'stage', 'seconds', 'rows/s', 'peak MB'))
+	for r in results:
+		print('{0:<28} {1:>10d} {2:>8} {3:>12.4f} {4:>14.0f} {5:>10.1f}'.format(r['capture'], r['rows'], r['stage'], r['seconds'], r['rows_per_s'], r['peak_mb']))
+	return None
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description = 'Benchmark grasp_analysis and check its results against golden values')
+	parser.add_argument('--sizes', type = int, nargs = '*', default = SYNTHETIC_SIZES, help = 'rows of each synthetic capture (none: bundled captures only)')
+	parser.add_argument('--repeat', type = int, default = 3, help = 'runs per stage, the fastest one is reported')
+	parser.add_argument('--no-render', action = 'store_true', help = 'skip the render stage')
+	parser.add_argument('--json', default = None, help = 'also write the results to this file')
+	parser.add_argument('--update-golden', action = 'store_true', help = 'rewrite ' + os.path.basename(GOLDEN_PATH) + ' from the current results and exit')
+	args = parser.parse_args()
+
+	if args.update_golden:
+		golden = {}
+		for path in BUNDLED_CAPTURES:
+			f1, f2 = angles_stage(load_stage(path))
+			golden[os.path.basename(path)] = golden_values(f1, f2)
+		save_golden(golden)
+		print('Golden values of {0} captures written to {1}'.format(len(golden), GOLDEN_PATH))
+		sys.exit(0)
+
+	golden = load_golden()
+	workdir = tempfile.mkdtemp(prefix = 'grasp_benchmark_')
+	results = []
+	failures = []
+	try:
+		captures = list(BUNDLED_CAPTURES)
+		for rows in args.sizes:
+			start = clock()
+			captures.append(make_synthetic(os.path.join(workdir, 'synthetic_{0}.csv'.format(rows)), rows))
+			print('Synthetic capture of {0} rows written in {1:.1f} s'.format(rows, clock() - start))
+		for path in captures:
+			stages, (f1, f2) = benchmark_capture(path, args.repeat, not args.no_render, os.path.join(workdir, 'figures'))
+			results += stages
+			name = os.path.basename(path)
+			if name in golden:
+				problems = compare_golden(golden[name], golden_values(f1, f2))
+				failures += ['{0}: {1}'.format(name, problem) for problem in problems]
+				print('{0}: golden check {1}'.format(name, 'FAILED' if problems else 'passed'))
+	finally:
+		shutil.rmtree(workdir, ignore_errors = True)
+
+	print_results(results)
+	if tracemalloc is None:
+		print('Peak MB is the process high-water mark (no tracemalloc on this Python)')
+	if args.json is not None:
+		with open(args.json, 'w') as f:
+			json.dump({'results': results, 'golden_failures': failures}, f, indent = 1)
+	for failure in failures:
+		print(failure)
+	sys.exit(1 if failures else 0)
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+
+#######################################################################################
+#Similarity index of a grasp-capture library
+#Every trial becomes one fixed-length feature vector: its four joint angles (finger 1 and 2, proximal and distal)
+#resampled to INDEX_POINTS evenly spaced samples over the trial, the fraction of the trial spent in each grasp phase and
+#the mean joint angles of the Final Grasp phase. All of them are in radians or fractions of one, so plain euclidean
+#distance between vectors compares trials.
+#The index is one .npz file with the capture paths, their size and mtime and the (trials, features) matrix.
+#Building it again adds the captures given, recomputes the indexed ones that changed and drops the ones that are gone
+#from disk, everything else is kept as it is (--prune also drops the ones not given).
+#Build or update -> python grasp_index.py build library.npz captures/ [--workers N] [--prune]
+#Trials most like a capture -> python grasp_index.py query library.npz cy_grasp_data.csv [-k 5]
+
+#######################################################################################
+import os
+import sys
+import json
+import time
+import argparse
+import functools
+import numpy as np
+
+import grasp_analysis as grasp
+
+#Samples of every resampled joint-angle curve
+INDEX_POINTS = 32
+
+#Layout of the index file, a file written with another version is rebuilt from scratch
+INDEX_VERSION = 1
+
+#Neighbours returned by a query
+INDEX_K = 5
+
+#Feature vector of a trial from its trial_angles columns (N, 4)
+def trial_features(angles, points = INDEX_POINTS):
+	angles = np.asarray(angles, dtype=np.float64)
+	n = len(angles)
+	#Linear resampling of all four curves at once
+	t = np.linspace(0, n - 1, points)
+	lo = np.floor(t).astype(np.int64)
+	hi = np.minimum(lo + 1, n - 1)
+	w = (t - lo)[:,None]
+	curves = angles[lo] * (1 - w) + angles[hi] * w
+	bounds = grasp.segment_phases(angles)[0]
+	fractions = [float(stop - start) / n for start, stop in bounds]
+	final = angles[bounds[2][0]:] if bounds[2][0] < n else angles[-1:]
+	return np.concatenate([curves.T.ravel(), fractions, final.mean(axis = 0)])
+
+#Features of one capture file as (path, size, mtime, features or None, error), run in a worker process
+def capture_features(filename, points = INDEX_POINTS):
+	try:
+		st = os.stat(filename)
+		pos = grasp.load_capture(filename)
+		f1 = grasp.finger(pos[:,0:4])
+		f2 = grasp.finger(pos[:,4:])
+		f1.compute_joint_angles(1)
+		f2.compute_joint_angles(2)
+		return filename, st.st_size, st.st_mtime, trial_features(grasp.trial_angles(f1, f2), points), ''
+	except (IOError, OSError, ValueError, IndexError) as e:
+		return filename, 0, 0.0, None, str(e)
+
+#Empty index for feature vectors of INDEX_POINTS curves
+def empty_index(points = INDEX_POINTS):
+	return {'points': points, 'paths': [], 'sizes': np.zeros(0, dtype=np.int64), 'mtimes': np.zeros(0), 'features': np.zeros((0, 4 * points + len(grasp.PHASE_NAMES) + 4))}
+
+def load_index(path):
+	with np.load(path) as data:
+		#tolist() gives the text back as str, unicode or bytes depending on the Python that wrote and reads it
+		meta = json.loads(data['meta'].tolist())
+		if meta['version'] != INDEX_VERSION:
+			raise ValueError("{0} is an index of version {1}, this is version {2}".format(path, meta['version'], INDEX_VERSION))
+		return {'points': meta['points'], 'paths': meta['paths'], 'sizes': data['sizes'], 'mtimes': data['mtimes'], 'features': data['features']}
+
+#Write the index under a temporary name and rename it, so a crash never leaves half an index
+def save_index(path, index):
+	meta = json.dumps({'version': INDEX_VERSION, 'points': index['points'], 'paths': index['paths']})
+	with open(path + '.tmp', 'wb') as f:
+		np.savez(f, meta = np.array(meta), sizes = index['sizes'], mtimes = index['mtimes'], features = index['features'])
+	os.rename(path + '.tmp', path)
+	return None
+
+#Add files to an index and bring it up to date: entries whose size and mtime still match are kept, new or changed
+#captures are computed on a pool of worker processes and entries of files gone from disk are dropped
+#With prune, entries of files that are not in files are dropped as well
+#Returns (index, computed, errors) with errors as a list of (path, message)
+def update_index(index, files, workers = None, prune = False):
+	files = [os.path.abspath(filename) for filename in files]
+	if not prune:
+		given = set(files)
+		files = [path for path in index['paths'] if path not in given and os.path.exists(path)] + files
+	row = dict((path, i) for i, path in enumerate(index['paths']))
+	keep = []
+	todo = []
+	for filename in files:
+		i = row.get(filename)
+		if i is not None and os.path.exists(filename):
+			st = os.stat(filename)
+			if index['sizes'][i] == st.st_size and index['mtimes'][i] == st.st_mtime:
+				keep.append(i)
+				continue
+		todo.append(filename)
+
+	results = grasp.map_pool(functools.partial(capture_features, points = index['points']), todo, workers) if todo else []
+	computed = [r for r in results if r[3] is not None]
+	errors = [(r[0], r[4]) for r in results if r[3] is None]
+	keep = np.array(keep, dtype=np.int64)
+	updated = {
+		'points': index['points'],
+		'paths': [index['paths'][i] for i in keep] + [r[0] for r in computed],
+		'sizes': np.concatenate([index['sizes'][keep], np.array([r[1] for r in computed], dtype=np.int64)]),
+		'mtimes': np.concatenate([index['mtimes'][keep], np.array([r[2] for r in computed], dtype=np.float64)]),
+		'features': np.vstack([index['features'][keep]] + [r[3][None,:] for r in computed]),
+	}
+	return updated, len(computed), errors
+
+#k nearest trials of every query vector (Q, features) or (features,), as (rows, distances) of shape (Q, k)
+#exclude is one index row per query that may not be returned (the query trial itself), -1 for none
+def nearest(index, queries, k = INDEX_K, exclude = None):
+	features = index['features']
+	queries = np.atleast_2d(np.asarray(queries, dtype=np.float64))
+	k = min(k, len(features) - (0 if exclude is None else 1))
+	if k <= 0:
+		return np.zeros((len(queries), 0), dtype=np.int64), np.zeros((len(queries), 0))
+	#|a - b|^2 = |a|^2 - 2 a.b + |b|^2 for every pair with one matrix product, |b|^2 of the index is kept in index['norms']
+	if index.get('norms') is None or len(index['norms']) != len(features):
+		index['norms'] = (features * features).sum(axis = 1)
+	d2 = np.dot(queries, features.T)
+	d2 *= -2
+	d2 += index['norms']
+	d2 += (queries * queries).sum(axis = 1)[:,None]
+	np.maximum(d2, 0, out = d2)
+	if exclude is not None:
+		exclude = np.asarray(exclude)
+		d2[np.flatnonzero(exclude >= 0), exclude[exclude >= 0]] = np.inf
+	rows = np.argpartition(d2, k - 1, axis = 1)[:,:k]
+	query_rows = np.arange(len(d2))[:,None]
+	rows = rows[query_rows, np.argsort(d2[query_rows, rows], axis = 1)]
+	return rows, np.sqrt(d2[query_rows, rows])
+
+#Nearest trials of a capture file: its stored features when it is in the index and unchanged, else computed now
+def query_capture(index, filename, k = INDEX_K):
+	path = os.path.abspath(filename)
+	if path in index['paths']:
+		i = index['paths'].index(path)
+		st = os.stat(path)
+		if index['sizes'][i] == st.st_size and index['mtimes'][i] == st.st_mtime:
+			return nearest(index, index['features'][i], k, [i])
+	name, size, mtime, features, error = capture_features(path, index['points'])
+	if features is None:
+		raise ValueError(error)
+	return nearest(index, features, k)
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description = 'Similarity index of grasp captures')
+	commands = parser.add_subparsers(dest = 'command')
+	build = commands.add_parser('build', help = 'create or update an index from captures')
+	build.add_argument('index')
+	build.add_argument('captures', nargs = '+', help = 'capture csv files, directories or glob patterns')
+	build.add_argument('--workers', type = int, default = None, help = 'worker processes (default: one per cpu)')
+	build.add_argument('--prune', action = 'store_true', help = 'drop indexed trials that are not among the captures given')
+	query = commands.add_parser('query', help = 'trials of the index most like a capture')
+	query.add_argument('index')
+	query.add_argument('capture')
+	query.add_argument('-k', type = int, default = INDEX_K, help = 'number of trials returned')
+	args = parser.parse_args()
+
+	if args.command == 'build':
+		index = empty_index()
+		if os.path.exists(args.index):
+			try:
+				index = load_index(args.index)
+			except (ValueError, KeyError) as e:
+				print('Rebuilding {0}: {1}'.format(args.index, e))
+		files = sorted(set(filename for pattern in args.captures for filename in grasp.expand_captures(pattern)))
+		start = time.time()
+		index, computed, errors = update_index(index, files, args.workers, args.prune)
+		save_index(args.index, index)
+		for path, error in errors:
+			print('{0}: FAILED ({1})'.format(path, error))
+		print('{0}: {1} trials, {2} computed, {3} unchanged, {4} failed in {5:.2f} s'.format(args.index, len(index['paths']), computed, len(index['paths']) - computed, len(errors), time.time() - start))
+	elif args.command == 'query':
+		index = load_index(args.index)
+		start = time.time()
+		rows, distances = query_capture(index, args.capture, args.k)
+		elapsed = time.time() - start
+		for row, distance in zip(rows[0], distances[0]):
+			print('{0:.4f}  {1}'.format(distance, index['paths'][row]))
+		print('{0} of {1} trials in {2:.1f} ms'.format(len(rows[0]), len(index['paths']), elapsed * 1000))
+	else:
+		parser.print_help()
+		sys.exit(1)
@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+
+#######################################################################################
+#Live joint angles from an OptiTrack stream
+#online_estimator takes one sample or a small batch of marker rows (the 8 capture columns) at a time and keeps the
+#current proximal/distal joint angles of both fingers, their running min/max/mean and the current grasp phase
+#in fixed-size arrays, so every update costs the same however long the session runs.
+#Sources: a capture file that is still being written (tail) or csv lines in UDP datagrams
+#Follow a file -> python grasp_online.py --tail capture.csv [--from-start]
+#Listen on UDP -> python grasp_online.py --udp 5005
+#Send a recorded capture as a live stream -> python grasp_online.py --replay cy_grasp_data.csv --udp 5005 [--rate 120]
+
+#######################################################################################
+import sys
+import time
+import socket
+import argparse
+import numpy as np
+
+from grasp_analysis import CAPTURE_COLUMNS, FINGER_ORIGINS, PHASE_NAMES, PHASE_SPEED, PHASE_SMOOTHING, PHASE_HOLD, joint_angles, parse_rows
+
+#Angles kept by the estimator, in this order
+ONLINE_COLUMNS = ['f1_prox', 'f1_dist', 'f2_prox', 'f2_dist']
+
+#Seconds between status lines on the command line
+ONLINE_PRINT_PERIOD = 0.5
+
+#Seconds a source waits for new data before checking again
+ONLINE_POLL = 0.002
+
+#Incremental joint-angle estimator for both fingers
+class online_estimator():
+	def __init__(self, origins = FINGER_ORIGINS, speed = PHASE_SPEED, smoothing = PHASE_SMOOTHING, hold = PHASE_HOLD):
+		self.origins = origins
+		self.threshold = speed
+		self.alpha = 1.0 / smoothing
+		self.hold = hold
+		self.count = 0
+		self.angles = np.zeros(len(ONLINE_COLUMNS))
+		self.lengths = np.zeros(len(ONLINE_COLUMNS))
+		self.min = np.full(len(ONLINE_COLUMNS), np.inf)
+		self.max = np.full(len(ONLINE_COLUMNS), -np.inf)
+		self.mean = np.zeros(len(ONLINE_COLUMNS))
+		self.speed = 0.0
+		self.still = 0
+		self.phase = 0
+		#Sample index where each phase was last entered (-1: not yet)
+		self.phase_start = [0] + [-1] * (len(PHASE_NAMES) - 1)
+
+	#Take one sample (8 values) or a batch of rows, returns the joint angles of the newest sample
+	def update(self, rows):
+		rows = np.asarray(rows, dtype = np.float64).reshape(-1, CAPTURE_COLUMNS)
+		if len(rows) == 0:
+			return self.angles
+		f1 = joint_angles(rows[:,0:4], self.origins[1][0], self.origins[1][1], mirrored = True)
+		f2 = joint_angles(rows[:,4:], self.origins[2][0], self.origins[2][1])
+		angles = np.column_stack([f1[2], f1[3], f2[2], f2[3]])
+
+		#Largest joint change per sample, the first sample of a session has none
+		previous = self.angles if self.count else angles[0]
+		steps = np.abs(np.diff(np.vstack([previous, angles]), axis = 0)).max(axis = 1)
+		for i, step in enumerate(steps.tolist()):
+			self.track_phase(step, self.count + i)
+
+		#Running statistics
+		n = self.count + len(angles)
+		np.minimum(self.min, angles.min(axis = 0), out = self.min)
+		np.maximum(self.max, angles.max(axis = 0), out = self.max)
+		self.mean += (angles.sum(axis = 0) - len(angles) * self.mean) / n
+		self.count = n
+		self.angles[:] = angles[-1]
+		self.lengths[:] = [f1[0][-1], f1[1][-1], f2[0][-1], f2[1][-1]]
+		return self.angles
+
+	#Advance the phase by one sample: Grasp Setup until the hand first moves, Pre-Grasp while it moves,
+	#Final Grasp once it has been still for hold samples (a new movement goes back to Pre-Grasp)
+	def track_phase(self, step, index):
+		self.speed += (step - self.speed) * self.alpha
+		if self.speed > self.threshold:
+			self.still = 0
+			if self.phase != 1:
+				self.set_phase(1, index)
+		else:
+			self.still += 1
+			if self.phase == 1 and self.still >= self.hold:
+				self.set_phase(2, index)
+		return None
+
+	def set_phase(self, phase, index):
+		self.phase = phase
+		self.phase_start[phase] = index
+		return None
+
+	def phase_name(self):
+		return PHASE_NAMES[self.phase]
+
+	#One status line: samples, current angles, running min/max/mean and phase
+	def status(self):
+		angles = '  '.join('{0} {1:.3f} [{2:.3f} {3:.3f} {4:.3f}]'.format(name, a, lo, hi, m) for name, a, lo, hi, m in zip(ONLINE_COLUMNS, self.angles, self.min, self.max, self.mean))
+		return '{0} samples  {1}  |  {2} since sample {3}'.format(self.count, angles, self.phase_name(), self.phase_start[self.phase])
+
+#Parse csv text of whole rows like parse_rows, but skip the lines that do not parse (a header line, a garbled row)
+#instead of failing the whole batch, returns (rows, number of lines skipped)
+def parse_good_rows(text, name):
+	try:
+		return parse_rows(text, name), 0
+	except ValueError:
+		pass
+	rows = []
+	bad = 0
+	for line in text.splitlines():
+		if not line.strip():
+			continue
+		try:
+			rows.append(parse_rows(line, name))
+		except ValueError:
+			bad += 1
+	return (np.vstack(rows) if rows else np.zeros((0, CAPTURE_COLUMNS))), bad
+
+#Batches of rows appended to a capture file, from its current end (or its start) on
+#A line still being written stays in the buffer until its newline arrives
+#Lines that do not parse are counted in errors and skipped
+class tail_source():
+	def __init__(self, filename, from_start = False, poll = ONLINE_POLL):
+		self.filename = filename
+		self.from_start = from_start
+		self.poll = poll
+		self.errors = 0
+
+	def __iter__(self):
+		with open(self.filename, 'rb') as f:
+			if not self.from_start:
+				f.seek(0, 2)
+			pending = b''
+			while True:
+				data = f.read()
+				if not data:
+					time.sleep(self.poll)
+					continue
+				pending += data
+				end = pending.rfind(b'\n') + 1
+				if end:
+					rows, bad = parse_good_rows(pending[:end], self.filename)
+					pending = pending[end:]
+					self.errors += bad
+					if len(rows):
+						yield rows
+
+#Batches of rows from UDP datagrams of csv lines (one or more whole lines per datagram)
+#Lines that do not parse are counted in errors and skipped
+class udp_source():
+	def __init__(self, port, host = '127.0.0.1', timeout = 1.0):
+		self.port = port
+		self.host = host
+		self.timeout = timeout
+		self.errors = 0
+
+	def __iter__(self):
+		sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+		sock.bind((self.host, self.port))
+		sock.settimeout(self.timeout)
+		try:
+			while True:
+				try:
+					data = sock.recv(65536)
+				except socket.timeout:
+					continue
+				rows, bad = parse_good_rows(data, 'udp:{0}'.format(self.port))
+				self.errors += bad
+				if len(rows):
+					yield rows
+		finally:
+			sock.close()
+
+#Send a capture as UDP datagrams of one line at rate lines per second, like a live mocap stream
+def replay_udp(filename, port, rate = 120.0, host = '127.0.0.1'):
+	sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+	period = 1.0 / rate
+	start = time.time()
+	sent = 0
+	with open(filename, 'rb') as f:
+		for line in f:
+			if not line.strip():
+				continue
+			delay = start + sent * period - time.time()
+			if delay > 0:
+				time.sleep(delay)
+			sock.sendto(line, (host, port))
+			sent += 1
+	sock.close()
+	return sent
+
+#Feed every batch of a source to an estimator, printing a status line every ONLINE_PRINT_PERIOD seconds
+def run(source, estimator, print_period = ONLINE_PRINT_PERIOD):
+	next_print = time.time() + print_period
+	last_count = 0
+	for rows in source:
+		estimator.update(rows)
+		now = time.time()
+		if now >= next_print:
+			rate = (estimator.count - last_count) / (now - next_print + print_period)
+			print('{0}  ({1:.0f} samples/s)'.format(estimator.status(), rate))
+			last_count = estimator.count
+			next_print = now + print_period
+	return estimator
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description = 'Live joint angles and grasp phase from an OptiTrack stream')
+	parser.add_argument('--tail', default = None, help = 'follow a capture csv that is being written')
+	parser.add_argument('--from-start', action = 'store_true', help = 'with --tail, also process the rows already in the file')
+	parser.add_argument('--udp', type = int, default = None, help = 'UDP port of the stream')
+	parser.add_argument('--replay', default = None, help = 'send this capture to --udp instead of listening')
+	parser.add_argument('--rate', type = float, default = 120.0, help = 'lines per second for --replay')
+	args = parser.parse_args()
+
+	if args.replay is not None:
+		if args.udp is None:
+			sys.exit("--replay needs --udp PORT")
+		print('{0} lines sent'.format(replay_udp(args.replay, args.udp, args.rate)))
+		sys.exit(0)
+	if args.tail is not None:
+		source = tail_source(args.tail, args.from_start)
+	elif args.udp is not None:
+		source = udp_source(args.udp)
+	else:
+		sys.exit("Give a source: --tail capture.csv or --udp PORT")
+	estimator = online_estimator()
+	try:
+		run(source, estimator)
+	except KeyboardInterrupt:
+		pass
+	print(estimator.status())
+	if source.errors:
+		print('{0} lines skipped that did not parse'.format(source.errors))
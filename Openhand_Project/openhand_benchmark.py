@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###########################################################
+#Hardware-free benchmark of the Openhand controller loop
+#Runs the controller against the simulated servos and Slidy Box in openhand_sim and reports
+#loop rate, command-to-settle latency and bus packets per tick.
+#Modes: "legacy" is the original loop (blocking Slidy Box read, one TxRx per servo, busy-wait readback),
+#       "bus" is ControlLoop on a ServoBus
+#Usage: python openhand_benchmark.py [--mode both] [--duration 5] [--rate 100] [--input-rate 50] [--settle-policy all]
+#############################################################
+
+import os
+import sys
+import argparse
+
+import openhand_sim as sim
+import openhand_controller_final as controller
+
+#Slidy Box input that jumps between two poses every period seconds so every step has a settle time to measure
+def step_source(period):
+    def source(t):
+        if int(t / period) % 2:
+            return [2.0, 2.0, 2.0, 2.5]
+        return [0.5, 0.5, 0.5, 0.5]
+    return source
+
+#Record command-to-settle latencies: a command starts when the goals change and ends when every servo is within threshold
+class SettleTimer():
+    def __init__(self):
+        self.goals = None
+        self.command_time = None
+        self.latencies = []
+
+    def command(self, goals, now):
+        if goals != self.goals:
+            self.goals = list(goals)
+            self.command_time = now
+        return None
+
+    def check(self, settled, now):
+        if self.command_time is not None and settled:
+            self.latencies.append(now - self.command_time)
+            self.command_time = None
+        return None
+
+#ControlLoop that feeds a SettleTimer
+class BenchmarkLoop(controller.ControlLoop):
+    def __init__(self, *args, **kwargs):
+        controller.ControlLoop.__init__(self, *args, **kwargs)
+        self.timer = SettleTimer()
+
+    def tick(self):
+        start = controller.clock()
+        seq, val, goals = self.reader.latest()
+        if goals is not None and seq != self.last_seq:
+            self.timer.command(goals, start)
+        controller.ControlLoop.tick(self)
+        self.timer.check(all(status is True for status in self.status.values()), controller.clock())
+        return None
+
+#Open the simulated port and return (port_num, Slidybox), with every servo torqued on
+def setup(dxl, serial_module):
+    controller.use_backend(dxl, serial_module)
+    port_num = dxl.portHandler(controller.DEVICENAME)
+    dxl.packetHandler()
+    port = controller.SetUp_(port_num)
+    port.Open_port()
+    port.Set_baudrate()
+    for ID in controller.OPENHAND_IDS:
+        controller.Dynamixel_servo(port_num, controller.PROTOCOL_VERSION, ID).EnableTorque()
+    s = controller.Slidybox(controller.SLIDYBOX_PORT, controller.SLIDYBOX_BAUDRATE)
+    s.Open_Slidybox()
+    return port_num, s
+
+#Original controller loop: blocking Slidy Box read, one Move per servo, poll until any servo is within threshold
+def run_legacy(port_num, s, duration):
+    servos = dict((ID, controller.Dynamixel_servo(port_num, controller.PROTOCOL_VERSION, ID)) for ID in controller.OPENHAND_IDS)
+    timer = SettleTimer()
+    ticks = 0
+    start = controller.clock()
+    while controller.clock() - start < duration:
+        s.Read_Slidybox()
+        goals = s.map().tolist()
+        timer.command(goals, controller.clock())
+        for ID, servo in servos.items():
+            servo.Move(goals[controller.SLIDYBOX_CHANNELS[ID]])
+        while 1:
+            status = [servo.PresentPos_spread() if ID in controller.SPREAD_IDS else servo.PresentPos_finger() for ID, servo in servos.items()]
+            timer.check(all(x is True for x in status), controller.clock())
+            if any(status):
+                break
+        ticks += 1
+    return ticks, controller.clock() - start, timer
+
+#ControlLoop on a ServoBus with the Slidy Box on a reader thread
+def run_bus(port_num, s, duration, rate_hz, settle_policy = controller.SETTLE_POLICY):
+    bus = controller.ServoBus(port_num, controller.PROTOCOL_VERSION, controller.OPENHAND_IDS)
+    telemetry = controller.Telemetry()
+    reader = controller.SlidyboxReader(s, telemetry)
+    reader.start()
+    loop = BenchmarkLoop(bus, reader, rate_hz, telemetry = telemetry, settle_policy = settle_policy)
+    loop.run(duration)
+    reader.stop()
+    reader.join(1.0)
+    return loop.ticks, loop.stop_time - loop.start_time, loop.timer
+
+#Run one mode against a fresh simulator and return a dict of results
+def benchmark(mode, duration, rate_hz, input_rate, step_period, return_delay, settle_policy = controller.SETTLE_POLICY):
+    dxl = sim.SimDynamixel(controller.OPENHAND_IDS, controller.BAUDRATE, return_delay)
+    serial_module = sim.SimSerialModule(input_rate, source = step_source(step_period))
+    port_num, s = setup(dxl, serial_module)
+    dxl.reset_stats()
+
+    #Keep controller output off the terminal but inside the measurement
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        if mode == 'legacy':
+            ticks, elapsed, timer = run_legacy(port_num, s, duration)
+        else:
+            ticks, elapsed, timer = run_bus(port_num, s, duration, rate_hz, settle_policy)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+    tx_packets, rx_packets, nbytes, bus_time = dxl.reset_stats()
+    latencies = sorted(timer.latencies)
+    return {
+        'mode': mode,
+        'ticks': ticks,
+        'loop_hz': ticks / elapsed,
+        'packets_per_tick': float(tx_packets) / max(ticks, 1),
+        'status_packets_per_tick': float(rx_packets) / max(ticks, 1),
+        'bus_ms_per_tick': bus_time * 1000 / max(ticks, 1),
+        'settles': len(latencies),
+        'settle_p50_ms': latencies[len(latencies) // 2] * 1000 if latencies else float('nan'),
+        'settle_max_ms': latencies[-1] * 1000 if latencies else float('nan'),
+    }
+
+#Final goals of CommandFilter moves that are rate limited or smoothed, which must end on their target
+#Returns the moves that did not as printable lines
+def check_command_filter():
+    problems = []
+    for max_rate, smoothing in [(1000, None), (2000, 0.1), (None, 0.1)]:
+        for target in range(990, 1010):
+            f = controller.CommandFilter([1], max_rate = max_rate, smoothing = smoothing)
+            f.set_target(1, 0)
+            f.update(0.0)
+            f.set_target(1, target)
+            for i in range(1, 400):
+                f.update(i * 0.01)
+            if f.sent[1] != target:
+                problems.append("max_rate %s, smoothing %s: target %d ends at %d" % (max_rate, smoothing, target, f.sent[1]))
+    return problems
+
+def print_results(results):
+    print("%-8s %8s %9s %12s %12s %10s %8s %14s %14s" % ('mode', 'ticks', 'loop Hz', 'tx pkt/tick', 'rx pkt/tick', 'bus ms', 'settles', 'settle p50 ms', 'settle max ms'))
+    for r in results:
+        print("%-8s %8d %9.1f %12.2f %12.2f %10.3f %8d %14.1f %14.1f" % (r['mode'], r['ticks'], r['loop_hz'], r['packets_per_tick'], r['status_packets_per_tick'], r['bus_ms_per_tick'], r['settles'], r['settle_p50_ms'], r['settle_max_ms']))
+    return None
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Benchmark the Openhand controller loop against simulated hardware')
+    parser.add_argument('--mode', choices = ['legacy', 'bus', 'both'], default = 'both')
+    parser.add_argument('--duration', type = float, default = 5.0, help = 'seconds per mode')
+    parser.add_argument('--rate', type = float, default = controller.CONTROL_RATE_HZ, help = 'ControlLoop rate in Hz')
+    parser.add_argument('--input-rate', type = float, default = 50.0, help = 'Slidy Box lines per second')
+    parser.add_argument('--step-period', type = float, default = 1.0, help = 'seconds between Slidy Box pose changes')
+    parser.add_argument('--return-delay', type = float, default = sim.RETURN_DELAY, help = 'servo return delay in seconds')
+    parser.add_argument('--settle-policy', choices = ['all', 'any', 'timeout'], default = controller.SETTLE_POLICY, help = 'when ControlLoop considers a command finished')
+    args = parser.parse_args()
+
+    problems = check_command_filter()
+    print("Command filter check: %s" % ("FAILED" if problems else "passed"))
+    for problem in problems:
+        print(problem)
+    modes = ['legacy', 'bus'] if args.mode == 'both' else [args.mode]
+    print_results([benchmark(mode, args.duration, args.rate, args.input_rate, args.step_period, args.return_delay, args.settle_policy) for mode in modes])
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###########################################################
+#Calibration profiles for the Slidy Box to servo mapping
+#A calibration sweep is a CSV file of "id,slider,ticks" rows: for each servo, slider readings and the servo position
+#each one should command. build_profile() turns the sweep into one table per servo ID, sampled at evenly spaced
+#slider values with piecewise-linear interpolation between sweep points and clamped to the servo position limits.
+#Slidybox.Use_calibration(load_profile(path)) then maps every frame by table lookup.
+#Usage: python openhand_calibration.py build sweep.csv profile.npz [--size 2048] [--name left]
+#       python openhand_calibration.py linear profile.npz      (profile of the default linear scales)
+#       python openhand_calibration.py show profile.npz
+#############################################################
+
+import sys
+import json
+import argparse
+import numpy as np
+
+import openhand_controller_final as controller
+
+CALIBRATION_TABLE_SIZE      = 2048                          # Table entries per servo
+LINEAR_RANGES               = {'finger': (0.0, 2.5), 'spread': (0.0, 3.14)}  # Slider range of the default linear scales
+
+#Read a calibration sweep into {ID: (slider values, servo ticks)}, lines starting with # are comments
+def load_sweep(path):
+    data = np.loadtxt(path, delimiter = ',', comments = '#', ndmin = 2)
+    if data.shape[1] != 3:
+        raise ValueError("%s: sweep rows must be id,slider,ticks" % path)
+    sweep = {}
+    for ID in np.unique(data[:, 0]).astype(int).tolist():
+        rows = data[data[:, 0] == ID]
+        sweep[ID] = (rows[:, 1], rows[:, 2])
+    return sweep
+
+#Table of size servo positions at evenly spaced slider values from lo to hi (default: the sweep range)
+#Repeated slider values are averaged, values outside the sweep hold the end points
+def build_table(sliders, ticks, size = CALIBRATION_TABLE_SIZE, lo = None, hi = None):
+    sliders = np.asarray(sliders, dtype = np.float64)
+    ticks = np.asarray(ticks, dtype = np.float64)
+    if len(sliders) < 2:
+        raise ValueError("a calibration sweep needs at least two points per servo")
+    xs, inverse = np.unique(sliders, return_inverse = True)
+    ys = np.bincount(inverse, weights = ticks) / np.bincount(inverse)
+    lo = xs[0] if lo is None else lo
+    hi = xs[-1] if hi is None else hi
+    if not hi > lo:
+        raise ValueError("calibration slider range is empty (%g to %g)" % (lo, hi))
+    table = np.interp(np.linspace(lo, hi, size), xs, ys)
+    table = np.clip(np.rint(table), controller.DXL_MINIMUM_POSITION_VALUE, controller.DXL_MAXIMUM_POSITION_VALUE)
+    return lo, hi, table.astype(np.int64)
+
+#Profile from a sweep: {'name', 'ids', 'lo', 'hi', 'table'} with one row per ID
+def build_profile(sweep, size = CALIBRATION_TABLE_SIZE, name = ''):
+    IDs = sorted(sweep)
+    lo = np.zeros(len(IDs))
+    hi = np.zeros(len(IDs))
+    table = np.zeros((len(IDs), size), dtype = np.int64)
+    for row, ID in enumerate(IDs):
+        lo[row], hi[row], table[row] = build_table(sweep[ID][0], sweep[ID][1], size)
+    return {'name': name, 'ids': IDs, 'lo': lo, 'hi': hi, 'table': table}
+
+#Sweep that reproduces the linear Slidybox scales over LINEAR_RANGES (a starting point for a hand calibration)
+def linear_sweep(channels = controller.SLIDYBOX_CHANNELS, spread_ids = controller.SPREAD_IDS):
+    fingerscale = 2000 / 2.5
+    spreadscale = 4095 / 3.14
+    sweep = {}
+    for ID in channels:
+        if ID in spread_ids:
+            lo, hi = LINEAR_RANGES['spread']
+            sweep[ID] = (np.array([lo, hi]), 4095 - np.array([lo, hi]) * spreadscale)
+        else:
+            lo, hi = LINEAR_RANGES['finger']
+            sweep[ID] = (np.array([lo, hi]), np.array([lo, hi]) * fingerscale)
+    return sweep
+
+#Write a profile as .npz with its name in a json meta entry
+def save_profile(path, profile):
+    meta = json.dumps({'name': profile['name'], 'ids': list(profile['ids'])})
+    np.savez_compressed(path, meta = np.array(meta), ids = np.asarray(profile['ids']), lo = profile['lo'], hi = profile['hi'], table = profile['table'])
+    return None
+
+def load_profile(path):
+    with np.load(path) as data:
+        meta = json.loads(data['meta'].tolist())
+        return {'name': meta['name'], 'ids': data['ids'].tolist(), 'lo': data['lo'], 'hi': data['hi'], 'table': data['table']}
+
+#Per-ID slider range and positions at a few points of the table, as printable text
+def describe(profile, points = 5):
+    lines = ["Profile '%s': %d servo(s), %d entries per table" % (profile['name'], len(profile['ids']), profile['table'].shape[1])]
+    columns = np.linspace(0, profile['table'].shape[1] - 1, points).astype(int)
+    for row, ID in enumerate(profile['ids']):
+        sliders = profile['lo'][row] + columns * (profile['hi'][row] - profile['lo'][row]) / (profile['table'].shape[1] - 1)
+        pairs = "  ".join("%.3f->%d" % (x, profile['table'][row, c]) for x, c in zip(sliders, columns))
+        lines.append("[ID:%03d] %s" % (ID, pairs))
+    return "\n".join(lines)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Build and inspect Slidy Box calibration profiles')
+    commands = parser.add_subparsers(dest = 'command')
+    build = commands.add_parser('build', help = 'build a profile from a calibration sweep CSV (id,slider,ticks)')
+    build.add_argument('sweep')
+    build.add_argument('profile')
+    build.add_argument('--size', type = int, default = CALIBRATION_TABLE_SIZE, help = 'table entries per servo')
+    build.add_argument('--name', default = '')
+    linear = commands.add_parser('linear', help = 'write a profile of the default linear scales')
+    linear.add_argument('profile')
+    linear.add_argument('--size', type = int, default = CALIBRATION_TABLE_SIZE, help = 'table entries per servo')
+    show = commands.add_parser('show', help = 'print a profile')
+    show.add_argument('profile')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        profile = build_profile(load_sweep(args.sweep), args.size, args.name)
+        save_profile(args.profile, profile)
+    elif args.command == 'linear':
+        profile = build_profile(linear_sweep(), args.size, 'linear')
+        save_profile(args.profile, profile)
+    elif args.command == 'show':
+        profile = load_profile(args.profile)
+    else:
+        parser.print_help()
+        sys.exit(1)
+    print(describe(profile))
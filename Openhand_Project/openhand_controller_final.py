@@ -11,7 +11,15 @@
 #############################################################
 
 import os
+import sys
+import math
+import time
+import bisect
+import ctypes
+import threading
 import serial
+import numpy as np
+from openhand_telemetry import Telemetry, clock
 
 
 if os.name == 'nt':
@@ -19,12 +27,13 @@ if os.name == 'nt':
     def getch():
         return msvcrt.getch().decode()
 else:
-    import sys, tty, termios
-    fd = sys.stdin.fileno()
-    old_settings = termios.tcgetattr(fd)
+    import tty, termios
+    #Terminal settings are read on the first key press, not at import, so the controller also runs without a terminal
     def getch():
+        fd = sys.stdin.fileno()
+        old_settings = termios.tcgetattr(fd)
         try:
-            tty.setraw(sys.stdin.fileno())
+            tty.setraw(fd)
             ch = sys.stdin.read(1)
         finally:
             termios.tcsetattr(fd, termios.TCSADRAIN, old_settings)
@@ -32,13 +41,23 @@ else:
 
 os.sys.path.append('../dynamixel_functions_py')             # Path setting
 
-import dynamixel_functions as dynamixel
+try:
+    import dynamixel_functions as dynamixel
+except ImportError:
+    dynamixel = None                                        # No Dynamixel SDK, a backend must be given with use_backend()
 
 ###########################################################
 # Control Table Address
 ADDR_MX_TORQUE_ENABLE       = 24                            # Control table address is different in Dynamixel model
 ADDR_MX_GOAL_POSITION       = 30
 ADDR_MX_PRESENT_POSITION    = 36
+ADDR_MX_MOVING              = 46                            # 1 while the servo is still travelling to its goal
+
+# Data Byte Length
+LEN_MX_TORQUE_ENABLE        = 1
+LEN_MX_GOAL_POSITION        = 2
+LEN_MX_PRESENT_POSITION     = 2
+LEN_MX_PRESENT_TO_MOVING    = ADDR_MX_MOVING + 1 - ADDR_MX_PRESENT_POSITION  # Present position through Moving in one read
 
 # Protocol version
 PROTOCOL_VERSION            = 1                             # See which protocol version is used in the Dynamixel
@@ -61,50 +80,233 @@ ESC_ASCII_VALUE             = 0x1b
 COMM_SUCCESS                = 0                             # Communication Success result value
 COMM_TX_FAIL                = -1001                         # Communication Tx Failed
 
+OPENHAND_IDS                = [1, 2, 3, 4]                  # Every servo on the Openhand bus
+SPREAD_IDS                  = [3]                           # Servos that drive the spread instead of a finger
+SLIDYBOX_CHANNELS           = {1: 2, 2: 0, 3: 3, 4: 1}      # Slidy Box output channel that drives each servo ID
+
+SLIDYBOX_PORT               = "/dev/ttyACM0"                # Arduino Slidy Box serial port
+SLIDYBOX_BAUDRATE           = 9600
+SLIDYBOX_BINARY             = False                         # True when the Arduino sends binary frames instead of CSV text
+SLIDYBOX_CHANNEL_COUNT      = 4                             # Three fingers and the spread
+SLIDYBOX_FRAME_HEADER       = bytearray([0xAA, 0x55])       # Start of a binary Slidy Box frame
+SLIDYBOX_FRAME_SIZE         = 2 + 4 * SLIDYBOX_CHANNEL_COUNT + 1
+SLIDYBOX_CALIBRATION        = None                          # Calibration profile (.npz from openhand_calibration.py), None uses the linear scales
+
+CONTROL_RATE_HZ             = 100                           # Rate at which servo commands are sent
+JITTER_BINS_MS              = [0.1, 0.5, 1, 2, 5, 10]       # Upper edges of the tick jitter histogram bins (ms)
+TELEMETRY_FILE              = "openhand_telemetry.txt"      # Per-stage p50/p99/max written here on exit
+
+COMMAND_DEADBAND            = 4                             # Goal changes of this many ticks or less are not written
+COMMAND_MAX_RATE            = None                          # Largest goal change per second in ticks (None: no rate limit)
+COMMAND_SMOOTHING           = None                          # Time constant (s) of exponential goal smoothing (None: no smoothing)
+
+SETTLE_POLICY               = "all"                         # Command is finished when "all" servos settle, "any" servo settles, or "timeout": all settled or past deadline
+SETTLE_TIMEOUT              = 2.0                           # Seconds after a new goal before a servo that has not settled is marked timed out
+SETTLE_SPEED                = 55 * 4096 / 60.0              # MX-28 no-load speed (55 rpm) in ticks per second, used to predict arrival
+SETTLE_POLL_FRACTION        = 0.5                           # Poll again after this fraction of the predicted time to goal
+SETTLE_POLL_MIN             = 0.005                         # Shortest poll interval of a moving servo (s)
+SETTLE_POLL_MAX             = 0.1                           # Longest poll interval of a moving servo (s)
+SETTLE_IDLE_POLL            = 0.25                          # Poll interval of a settled servo (s)
+SETTLE_NEAR_FACTOR          = 4                             # Read the Moving register once within this many thresholds of the goal
+
 ##########################################################
 
+#Swap the Dynamixel SDK and pyserial modules for stand-ins with the same functions (e.g. openhand_sim)
+def use_backend(dxl_module = None, serial_module = None):
+    global dynamixel, serial
+    if dxl_module is not None:
+        dynamixel = dxl_module
+    if serial_module is not None:
+        serial = serial_module
+    return None
+
 #Class to setup device for Openhand (Leon,2017)
 class SetUp_():
-    def __init__(self, port_num):
+    def __init__(self, port_num, baudrate = None):
         global BAUDRATE
         if port_num == None:
             raise ValueError
-        self.baudrate = BAUDRATE
+        self.baudrate = baudrate or BAUDRATE
         self.port_num = port_num
 
-    #Open USB port that connected to Openhand
+    #Open USB port that connected to Openhand, raises IOError when it cannot be opened
     def Open_port(self):
         if dynamixel.openPort(self.port_num):
             return True
-        else:
-            print("Failed to open the port!")
-            print("Press any key to terminate...")
-            getch()
-            quit()
-            return False
-    #Set Baudrate for Openhand (for DynamixelSDK servo MX 28 is 57600)
+        raise IOError("Failed to open the port!")
+
+    #Set Baudrate for Openhand (for DynamixelSDK servo MX 28 is 57600), raises IOError when it cannot be set
     def Set_baudrate(self):
         if dynamixel.setBaudRate(self.port_num,self.baudrate):
             print("Succeeded to change baudrate!")
         else:
-            print("Failed to change the baudrate!")
-            print("Press any key to terminate...")
-            getch()
-            quit()
+            raise IOError("Failed to change the baudrate to %d!" % self.baudrate)
         return None
 
     #Close USB port
     def Close_port(self):
-        dynamixel.closePort(port_num)
+        dynamixel.closePort(self.port_num)
         return None
 
+#Class to drive every servo on one Openhand port as a group (Leon, 2017)
+#Goal positions go out as a single SYNC_WRITE packet and present positions come back with a single BULK_READ (MX series, protocol 1.0)
+class ServoBus():
+    def __init__(self, port_num, pro_ver, IDs = OPENHAND_IDS):
+        if port_num == None:
+            raise ValueError
+        self.port_num = port_num
+        self.pro_ver = pro_ver
+        self.IDs = list(IDs)
+        self.goalpos = dict((ID, 0) for ID in self.IDs)
+        self.present = dict((ID, 0) for ID in self.IDs)
+        self.moving = dict((ID, 1) for ID in self.IDs)
+        self.comm_result = dict((ID, COMM_TX_FAIL) for ID in self.IDs)
+        self.dirty = []
+        self.dxl_comm_result = COMM_TX_FAIL
+        self.dxl_error = 0
+        self.recorder = None                                # Optional openhand_recorder.ServoRecorder
+
+        #Bus statistics for the current tick and for the whole session
+        self.packets = 0
+        self.bus_time = 0.0
+        self.ticks = 0
+        self.total_packets = 0
+        self.total_bus_time = 0.0
+
+        #Initialize GroupSyncWrite and GroupBulkRead Structs (Leon, 2017)
+        self.group_write = dynamixel.groupSyncWrite(port_num, pro_ver, ADDR_MX_GOAL_POSITION, LEN_MX_GOAL_POSITION)
+        self.group_torque = dynamixel.groupSyncWrite(port_num, pro_ver, ADDR_MX_TORQUE_ENABLE, LEN_MX_TORQUE_ENABLE)
+        self.group_read = dynamixel.groupBulkRead(port_num, pro_ver)
+        for ID in self.IDs:
+            if not ctypes.c_ubyte(dynamixel.groupBulkReadAddParam(self.group_read, ID, ADDR_MX_PRESENT_POSITION, LEN_MX_PRESENT_POSITION)).value:
+                print("[ID:%03d] groupBulkRead addparam failed" % ID)
+        self.group_poll = dynamixel.groupBulkRead(port_num, pro_ver)     # Refilled by read_servos() for a subset of servos
+
+    #Check that every servo answers with one BULK_READ (which also loads their present positions)
+    #Only when it fails is each servo pinged on its own, to raise an IOError that names the missing IDs
+    def scan(self):
+        self.read_present()
+        if all(self.comm_result[ID] == COMM_SUCCESS for ID in self.IDs):
+            return list(self.IDs)
+        missing = []
+        for ID in self.IDs:
+            dynamixel.ping(self.port_num, self.pro_ver, ID)
+            if dynamixel.getLastTxRxResult(self.port_num, self.pro_ver) != COMM_SUCCESS:
+                missing.append(ID)
+        if missing:
+            raise IOError("No answer from servo IDs %s" % missing)
+        self.read_present()
+        return list(self.IDs)
+
+    #Switch torque of every servo on (TORQUE_ENABLE) or off (TORQUE_DISABLE) with one SYNC_WRITE packet
+    def set_torque(self, value):
+        start = clock()
+        for ID in self.IDs:
+            if not ctypes.c_ubyte(dynamixel.groupSyncWriteAddParam(self.group_torque, ID, value, LEN_MX_TORQUE_ENABLE)).value:
+                print("[ID:%03d] groupSyncWrite addparam failed" % ID)
+        dynamixel.groupSyncWriteTxPacket(self.group_torque)
+        self.dxl_comm_result = dynamixel.getLastTxRxResult(self.port_num, self.pro_ver)
+        dynamixel.groupSyncWriteClearParam(self.group_torque)
+        self.packets += 1
+        self.bus_time += clock() - start
+        if self.dxl_comm_result != COMM_SUCCESS:
+            print(dynamixel.getTxRxResult(self.pro_ver, self.dxl_comm_result))
+            return False
+        return True
+
+    #Return a Dynamixel_servo that reads and writes through this bus
+    def servo(self, ID):
+        return Dynamixel_servo(self.port_num, self.pro_ver, ID, bus = self)
+
+    #Stage a goal position, it is sent on the next write_goals()
+    def set_goal(self, ID, goalpos):
+        self.goalpos[ID] = int(goalpos)
+        if ID not in self.dirty:
+            self.dirty.append(ID)
+        return None
+
+    #Send every staged goal position in one SYNC_WRITE packet (Leon, 2017)
+    def write_goals(self):
+        if not self.dirty:
+            return None
+        start = clock()
+        for ID in self.dirty:
+            if not ctypes.c_ubyte(dynamixel.groupSyncWriteAddParam(self.group_write, ID, self.goalpos[ID], LEN_MX_GOAL_POSITION)).value:
+                print("[ID:%03d] groupSyncWrite addparam failed" % ID)
+        dynamixel.groupSyncWriteTxPacket(self.group_write)
+        self.dxl_comm_result = dynamixel.getLastTxRxResult(self.port_num, self.pro_ver)
+        dynamixel.groupSyncWriteClearParam(self.group_write)
+        if self.recorder is not None:
+            now = clock()
+            for ID in self.dirty:
+                self.recorder.record(now, ID, self.goalpos[ID], self.present[ID], self.dxl_comm_result)
+        self.dirty = []
+        self.packets += 1
+        self.bus_time += clock() - start
+        if self.dxl_comm_result != COMM_SUCCESS:
+            print(dynamixel.getTxRxResult(self.pro_ver, self.dxl_comm_result))
+        return None
+
+    #Read present position of every servo with one BULK_READ instruction (Leon, 2017)
+    def read_present(self):
+        return self.read_group(self.group_read, self.IDs)
+
+    #Read present position of some servos with one BULK_READ, servos in moving_IDs also return their Moving register
+    def read_servos(self, IDs, moving_IDs = ()):
+        if not moving_IDs and len(IDs) == len(self.IDs):
+            return self.read_present()
+        dynamixel.groupBulkReadClearParam(self.group_poll)
+        for ID in IDs:
+            length = LEN_MX_PRESENT_TO_MOVING if ID in moving_IDs else LEN_MX_PRESENT_POSITION
+            if not ctypes.c_ubyte(dynamixel.groupBulkReadAddParam(self.group_poll, ID, ADDR_MX_PRESENT_POSITION, length)).value:
+                print("[ID:%03d] groupBulkRead addparam failed" % ID)
+        return self.read_group(self.group_poll, IDs, moving_IDs)
+
+    #Send a filled BULK_READ group and store the result of every servo in it
+    def read_group(self, group, IDs, moving_IDs = ()):
+        start = clock()
+        dynamixel.groupBulkReadTxRxPacket(group)
+        self.dxl_comm_result = dynamixel.getLastTxRxResult(self.port_num, self.pro_ver)
+        self.dxl_error = dynamixel.getLastRxPacketError(self.port_num, self.pro_ver)
+        for ID in IDs:
+            length = LEN_MX_PRESENT_TO_MOVING if ID in moving_IDs else LEN_MX_PRESENT_POSITION
+            if self.dxl_comm_result != COMM_SUCCESS:
+                self.comm_result[ID] = self.dxl_comm_result
+            elif ctypes.c_ubyte(dynamixel.groupBulkReadIsAvailable(group, ID, ADDR_MX_PRESENT_POSITION, length)).value:
+                self.present[ID] = dynamixel.groupBulkReadGetData(group, ID, ADDR_MX_PRESENT_POSITION, LEN_MX_PRESENT_POSITION)
+                if ID in moving_IDs:
+                    self.moving[ID] = dynamixel.groupBulkReadGetData(group, ID, ADDR_MX_MOVING, 1)
+                self.comm_result[ID] = COMM_SUCCESS
+            else:
+                self.comm_result[ID] = COMM_TX_FAIL
+        if self.recorder is not None:
+            now = clock()
+            for ID in IDs:
+                self.recorder.record(now, ID, self.goalpos[ID], self.present[ID], self.comm_result[ID])
+        self.packets += 1
+        self.bus_time += clock() - start
+        return self.present
+
+    #Return (packets, bus seconds) used since the last call and start counting the next tick
+    def tick_stats(self):
+        stats = (self.packets, self.bus_time)
+        self.ticks += 1
+        self.total_packets += self.packets
+        self.total_bus_time += self.bus_time
+        self.packets = 0
+        self.bus_time = 0.0
+        return stats
+
 #Class to actuate Openhand finger that attached to DynamixelSDK servo (Leon,2017)
+#When bus is given the servo is a view over a ServoBus: Move() stages the goal and present position comes from the last bulk read
 class Dynamixel_servo():
-    def __init__(self, port_num, pro_ver, ID = 1):
+    def __init__(self, port_num, pro_ver, ID = 1, bus = None):
         global COMM_SUCCESS, COMM_TX_FAIL, ADDR_MX_PRESENT_POSITION, ADDR_MX_GOAL_POSITION, ADDR_MX_TORQUE_ENABLE
         self.ID = ID
         self.port_num = port_num
         self.pro_ver = pro_ver
+        self.bus = bus
+        self.recorder = None                                # Optional openhand_recorder.ServoRecorder, servos on a bus are recorded by the bus
         self.addr_torque = ADDR_MX_TORQUE_ENABLE
         self.addr_present = ADDR_MX_PRESENT_POSITION
         self.addr_goal = ADDR_MX_GOAL_POSITION
@@ -130,50 +332,61 @@ class Dynamixel_servo():
     #Move servo and finger to goal position (Leon, 2017)
     def Move(self,goalpos):
         self.goalpos = int(goalpos)
+        if self.bus is not None:
+            # Staged on the bus, sent with the other servos on ServoBus.write_goals()
+            self.bus.set_goal(self.ID, self.goalpos)
+            return None
         # Write goal position
         dynamixel.write2ByteTxRx(self.port_num, self.pro_ver, self.ID, self.addr_goal, self.goalpos)
         self.dxl_comm_result = dynamixel.getLastTxRxResult(self.port_num, self.pro_ver)
         self.dxl_error = dynamixel.getLastRxPacketError(self.port_num, self.pro_ver)
+        if self.recorder is not None:
+            self.recorder.record(clock(), self.ID, self.goalpos, self.dxl_present_position, self.dxl_comm_result)
         if self.dxl_comm_result != self.COMM_SUCCESS:
             print(dynamixel.getTxRxResult(self.pro_ver, self.dxl_comm_result))
         elif self.dxl_error != 0:
             print(dynamixel.getRxPacketError(self.pro_ver, self.dxl_error))
         return None
 
-    #Print current position of finger(Leon,2017)
-    def PresentPos_finger(self):
-        #Print current pos with goalpos
-        global DXL_MOVING_STATUS_THRESHOLD
-        #Read present position
+    #Read present position, from the last bulk read when the servo is on a ServoBus (Leon, 2017)
+    def Read_present(self):
+        if self.bus is not None:
+            self.dxl_present_position = self.bus.present[self.ID]
+            self.dxl_comm_result = self.bus.comm_result[self.ID]
+            self.dxl_error = self.bus.dxl_error
+            return self.dxl_present_position
         self.dxl_present_position = dynamixel.read2ByteTxRx(self.port_num, self.pro_ver, self.ID, self.addr_present)
         self.dxl_comm_result = dynamixel.getLastTxRxResult(self.port_num, self.pro_ver)
         self.dxl_error = dynamixel.getLastRxPacketError(self.port_num, self.pro_ver)
+        if self.recorder is not None:
+            self.recorder.record(clock(), self.ID, getattr(self, 'goalpos', 0), self.dxl_present_position, self.dxl_comm_result)
+        return self.dxl_present_position
+
+    #Check current position of finger against goal position (Leon,2017)
+    #Positions are not printed here any more, ControlLoop prints a rate-limited summary
+    def PresentPos_finger(self):
+        global DXL_MOVING_STATUS_THRESHOLD
+        #Read present position
+        self.Read_present()
         if self.dxl_comm_result != self.COMM_SUCCESS:
             return(dynamixel.getTxRxResult(self.pro_ver, self.dxl_comm_result))
         elif self.dxl_error != 0:
             return(dynamixel.getRxPacketError(self.pro_ver, self.dxl_error))
 
-        print("[ID:%03d] GoalPos:%03d  PresPos:%03d" % (self.ID, self.goalpos, self.dxl_present_position))
-
         if not (abs(self.goalpos - self.dxl_present_position) > DXL_MOVING_STATUS_THRESHOLD_FINGER):
            return True
         return False
 
-    #Print current position of spread (Leon, 2017)
+    #Check current position of spread against goal position (Leon, 2017)
     def PresentPos_spread(self):
-        #Print current pos with goalpos
         global DXL_MOVING_STATUS_THRESHOLD
         #Read present position
-        self.dxl_present_position = dynamixel.read2ByteTxRx(self.port_num, self.pro_ver, self.ID, self.addr_present)
-        self.dxl_comm_result = dynamixel.getLastTxRxResult(self.port_num, self.pro_ver)
-        self.dxl_error = dynamixel.getLastRxPacketError(self.port_num, self.pro_ver)
+        self.Read_present()
         if self.dxl_comm_result != self.COMM_SUCCESS:
             return(dynamixel.getTxRxResult(self.pro_ver, self.dxl_comm_result))
         elif self.dxl_error != 0:
             return(dynamixel.getRxPacketError(self.pro_ver, self.dxl_error))
 
-        print("[ID:%03d] GoalPos:%03d  PresPos:%03d" % (self.ID, self.goalpos, self.dxl_present_position))
-
         if not (abs(self.goalpos - self.dxl_present_position) > DXL_MOVING_STATUS_THRESHOLD_SPREAD):
            return True
         return False
@@ -183,9 +396,7 @@ class Dynamixel_servo():
         #Print current pos without goalpos
         global DXL_MOVING_STATUS_THRESHOLD
         #Read present position
-        self.dxl_present_position = dynamixel.read2ByteTxRx(self.port_num, self.pro_ver, self.ID, self.addr_present)
-        self.dxl_comm_result = dynamixel.getLastTxRxResult(self.port_num, self.pro_ver)
-        self.dxl_error = dynamixel.getLastRxPacketError(self.port_num, self.pro_ver)
+        self.Read_present()
         if self.dxl_comm_result != self.COMM_SUCCESS:
             return(dynamixel.getTxRxResult(self.pro_ver, self.dxl_comm_result))
         elif self.dxl_error != 0:
@@ -218,38 +429,438 @@ class Dynamixel_servo():
         return None
 
 #Class for Arduino Slidy Box
+#Values are parsed into preallocated numpy buffers so nothing grows between frames
+#The Arduino can send either CSV text lines ("f1,f2,f3,spread") or binary frames (binary = True) of SLIDYBOX_FRAME_SIZE bytes:
+#header 0xAA 0x55, four little-endian float32 values, then one checksum byte (sum of the 16 value bytes & 0xFF)
 class Slidybox():
-    def __init__(self,port_name,baudrate):
+    def __init__(self,port_name,baudrate,binary = False):
         self.port_name = port_name
         self.baudrate = baudrate
+        self.binary = binary
         self.ser = serial.Serial(self.port_name, self.baudrate)
-        self.val = []
-        self.newval = []
+        self.val = np.zeros(SLIDYBOX_CHANNEL_COUNT)
+        self.read_time = 0.0                                # Seconds the last Read_Slidybox spent waiting on the serial port
+        self.newval = np.zeros(SLIDYBOX_CHANNEL_COUNT, dtype=np.int64)
+        self.frame_bytes = SLIDYBOX_FRAME_SIZE              # Size of the last frame or line, to tell when another one is queued
+        self.stale = 0                                      # Queued frames dropped by Read_latest
         self.fingerscale = 2000 / 2.5
         self.spreadscale = 4095 / 3.14
 
+        #Affine map for every channel: goal = offset + trunc(value * scale), the spread scale is negative because it is inversed
+        self.scale = np.array([self.fingerscale] * (SLIDYBOX_CHANNEL_COUNT - 1) + [-self.spreadscale])
+        self.offset = np.array([0.0] * (SLIDYBOX_CHANNEL_COUNT - 1) + [4095.0])
+        self.work = np.zeros(SLIDYBOX_CHANNEL_COUNT)
+
+        #Calibration lookup tables, set by Use_calibration: one row per channel, flattened so one take() maps every channel
+        self.table = None
+        self.table_lo = np.zeros(SLIDYBOX_CHANNEL_COUNT)
+        self.table_inv = np.zeros(SLIDYBOX_CHANNEL_COUNT)
+        self.table_row = np.zeros(SLIDYBOX_CHANNEL_COUNT, dtype=np.int64)
+        self.table_first = np.zeros(SLIDYBOX_CHANNEL_COUNT)
+        self.table_last = np.zeros(SLIDYBOX_CHANNEL_COUNT)
+        self.index = np.zeros(SLIDYBOX_CHANNEL_COUNT, dtype=np.int64)
+
+        #Binary frame buffer and a float32 view on its payload
+        self.frame = bytearray(SLIDYBOX_FRAME_SIZE)
+        self.frame_val = np.frombuffer(self.frame, dtype='<f4', count=SLIDYBOX_CHANNEL_COUNT, offset=len(SLIDYBOX_FRAME_HEADER))
+
     #Turn on Slidy Box and read outputs
     def Open_Slidybox(self):
-        self.ser.readline()
+        if not self.binary:
+            self.ser.readline()
         return None
 
     #Store slidy box output into array
     def Read_Slidybox(self):
-        self.newval = []
-        self.val = self.ser.readline().strip()
-        self.val = self.val.split(",")
-        for idx, x in enumerate(self.val):
-            self.val[idx] = float(x)
+        if self.binary:
+            return self.Read_frame()
+        start = clock()
+        line = self.ser.readline()
+        self.read_time = clock() - start
+        return self.Parse_line(line)
+
+    #Parse one CSV text line into the value buffer
+    def Parse_line(self, line):
+        self.frame_bytes = len(line)
+        val = np.fromstring(line, dtype=np.float64, sep=",")
+        if val.size != SLIDYBOX_CHANNEL_COUNT:
+            raise ValueError("Slidy Box line has %d values, expected %d" % (val.size, SLIDYBOX_CHANNEL_COUNT))
+        self.val[:] = val
         return self.val
 
+    #Read the newest frame, dropping older frames that queued up in the serial buffer
+    #Only the newest text line is parsed, a binary frame is checked before it is replaced by the next one
+    def Read_latest(self):
+        if self.binary:
+            self.Read_frame()
+            start = clock()
+            while self.ser.in_waiting >= SLIDYBOX_FRAME_SIZE:
+                self.Read_frame()
+                self.stale += 1
+            self.read_time += clock() - start
+            return self.val
+        start = clock()
+        line = self.ser.readline()
+        while self.ser.in_waiting >= self.frame_bytes:
+            line = self.ser.readline()
+            self.stale += 1
+        self.read_time = clock() - start
+        return self.Parse_line(line)
+
+    #Read one binary frame, sliding byte by byte onto the next header when the stream is out of sync
+    def Read_frame(self):
+        start = clock()
+        self.ser.readinto(self.frame)
+        while not self.Frame_valid():
+            self.frame[:-1] = self.frame[1:]
+            byte = self.ser.read(1)
+            if not byte:
+                raise ValueError("Slidy Box frame timed out")
+            self.frame[-1:] = byte
+        self.read_time = clock() - start
+        self.val[:] = self.frame_val
+        return self.val
+
+    #Check header and checksum of the frame buffer
+    def Frame_valid(self):
+        header = len(SLIDYBOX_FRAME_HEADER)
+        if not self.frame.startswith(SLIDYBOX_FRAME_HEADER):
+            return False
+        return sum(self.frame[header:-1]) & 0xFF == self.frame[-1]
+
+    #Map through the per-servo tables of a calibration profile (openhand_calibration.load_profile) instead of the linear scales
+    #Every table spans its own slider range with evenly spaced entries, so a value maps with one index computation per channel
+    def Use_calibration(self, profile, channels = SLIDYBOX_CHANNELS):
+        rows = dict((ID, row) for row, ID in enumerate(profile['ids']))
+        missing = [ID for ID in channels if ID not in rows]
+        if missing:
+            raise ValueError("Calibration profile has no table for servo IDs %s" % missing)
+        size = profile['table'].shape[1]
+        table = np.zeros((SLIDYBOX_CHANNEL_COUNT, size), dtype=np.int64)
+        for ID, channel in channels.items():
+            row = rows[ID]
+            table[channel] = profile['table'][row]
+            self.table_lo[channel] = profile['lo'][row]
+            self.table_inv[channel] = (size - 1) / (profile['hi'][row] - profile['lo'][row])
+        self.table = table.ravel()
+        self.table_row[:] = np.arange(SLIDYBOX_CHANNEL_COUNT) * size
+        self.table_last[:] = size - 1
+        return None
+
     #Map finger goal positions from 0.0 - 2.5 to 0 - 2000
     #Map spread goal positions from 0.0 - 3.14 to 4095 - 0 (It is inversed because of gear mechanisms of Openhand)
+    #With a calibration profile every channel is looked up in its table instead (nearest entry, clamped to the table range)
     def map(self):
-        for idx, x in enumerate(self.val[:-1]):
-            self.newval.append(int(x*self.fingerscale))
-        self.newval.append(4095 - int(self.val[-1]*self.spreadscale))
+        if self.table is not None:
+            np.subtract(self.val, self.table_lo, out=self.work)
+            np.multiply(self.work, self.table_inv, out=self.work)
+            np.rint(self.work, out=self.work)
+            np.minimum(self.work, self.table_last, out=self.work)
+            np.maximum(self.work, self.table_first, out=self.work)
+            self.index[:] = self.work
+            np.add(self.index, self.table_row, out=self.index)
+            self.table.take(self.index, out=self.newval)
+            return self.newval
+        np.multiply(self.val, self.scale, out=self.work)
+        np.trunc(self.work, out=self.work)
+        np.add(self.work, self.offset, out=self.work)
+        self.newval[:] = self.work
+        return self.newval
+
+#Thread that keeps only the newest Slidy Box frame so the control loop never blocks on the Arduino
+#Serial read and parse/map times go to telemetry when given
+class SlidyboxReader(threading.Thread):
+    def __init__(self, slidybox, telemetry = None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.slidybox = slidybox
+        self.telemetry = telemetry
+        self.lock = threading.Lock()
+        self.running = True
+        self.seq = 0
+        self.errors = 0
+        self.val = None
+        self.goals = None
+        self.stamp = 0.0
+
+    #Read and map frames until stopped, a garbled line is counted and skipped
+    def run(self):
+        while self.running:
+            start = clock()
+            try:
+                val = self.slidybox.Read_latest().tolist()
+                goals = self.slidybox.map().tolist()
+            except (ValueError, IndexError):
+                self.errors += 1
+                continue
+            if self.telemetry is not None:
+                self.telemetry.record('serial_read', self.slidybox.read_time)
+                self.telemetry.record('parse_map', clock() - start - self.slidybox.read_time)
+            with self.lock:
+                self.val = val
+                self.goals = goals
+                self.seq += 1
+                self.stamp = clock()
+
+    #Return (sequence number, raw values, mapped goal positions) of the newest frame
+    def latest(self):
+        with self.lock:
+            return self.seq, self.val, self.goals
+
+    def stop(self):
+        self.running = False
+        return None
 
-        return self.newval        
+#Command filter between Slidybox.map and Dynamixel_servo.Move
+#Goals from the Slidy Box become per-servo targets. update() returns only the goals that moved more than deadband ticks from
+#the last written goal, after an optional rate limit (ticks/s) and exponential smoothing (time constant in s) toward the target.
+#A rate-limited or smoothed servo keeps getting goals from update() until it reaches its target, also without new frames.
+class CommandFilter():
+    def __init__(self, IDs, deadband = COMMAND_DEADBAND, max_rate = COMMAND_MAX_RATE, smoothing = COMMAND_SMOOTHING):
+        self.IDs = list(IDs)
+        self.deadband = deadband
+        self.max_rate = max_rate
+        self.smoothing = smoothing
+        self.target = dict((ID, None) for ID in self.IDs)
+        self.value = dict((ID, None) for ID in self.IDs)
+        self.sent = dict((ID, None) for ID in self.IDs)
+        self.partial = dict((ID, False) for ID in self.IDs)    # Last write was a step on the way to the target
+        self.stamp = None
+        self.written = 0
+        self.suppressed = 0
+
+    #New goal from the Slidy Box for a servo
+    def set_target(self, ID, goal):
+        if self.sent[ID] is not None and abs(goal - self.sent[ID]) <= self.deadband:
+            self.suppressed += 1
+        self.target[ID] = goal
+        return None
+
+    #Advance every servo toward its target to time now and return [(ID, goal)] to write
+    def update(self, now):
+        dt = 0.0 if self.stamp is None else now - self.stamp
+        self.stamp = now
+        commands = []
+        for ID in self.IDs:
+            target = self.target[ID]
+            if target is None:
+                continue
+            value = self.value[ID]
+            if value is None:
+                value = float(target)
+            else:
+                previous = value
+                if self.smoothing:
+                    value += (target - value) * (1.0 - math.exp(-dt / self.smoothing))
+                    if abs(target - value) < 0.5:
+                        value = float(target)
+                else:
+                    value = float(target)
+                if self.max_rate is not None:
+                    step = self.max_rate * dt
+                    value = min(max(value, previous - step), previous + step)
+            self.value[ID] = value
+            goal = int(round(value))
+            #The deadband is for target changes, the last step of a rate limited or smoothed move is always written
+            arrived = self.partial[ID] and goal == int(round(target)) and goal != self.sent[ID]
+            if self.sent[ID] is None or abs(goal - self.sent[ID]) > self.deadband or arrived:
+                self.sent[ID] = goal
+                self.partial[ID] = goal != int(round(target))
+                self.written += 1
+                commands.append((ID, goal))
+        return commands
+
+#Settle detection for the servos of one bus, replacing a back-to-back poll of every servo
+#After a new goal each servo is polled again after a fraction of its predicted time to goal, so polls thin out while it travels
+#and close in as it arrives. Within SETTLE_NEAR_FACTOR thresholds its Moving register is read as well, and it is settled once
+#it is within threshold and no longer moving. A servo that has not settled by its deadline is marked timed out.
+class SettleDetector():
+    def __init__(self, IDs, policy = SETTLE_POLICY, timeout = SETTLE_TIMEOUT, speed = SETTLE_SPEED, spread_ids = SPREAD_IDS):
+        if policy not in ("all", "any", "timeout"):
+            raise ValueError("Unknown settle policy %r" % policy)
+        self.IDs = list(IDs)
+        self.policy = policy
+        self.timeout = timeout
+        self.speed = speed
+        self.threshold = dict((ID, DXL_MOVING_STATUS_THRESHOLD_SPREAD if ID in spread_ids else DXL_MOVING_STATUS_THRESHOLD_FINGER) for ID in self.IDs)
+        self.goal = dict((ID, None) for ID in self.IDs)
+        self.distance = dict((ID, 0) for ID in self.IDs)
+        self.deadline = dict((ID, 0.0) for ID in self.IDs)
+        self.next_poll = dict((ID, 0.0) for ID in self.IDs)
+        self.settled = dict((ID, False) for ID in self.IDs)
+        self.timed_out = dict((ID, False) for ID in self.IDs)
+        self.polls = 0
+        self.timeouts = 0
+
+    #Seconds until the next poll of a servo
+    def interval(self, ID):
+        if self.settled[ID] or self.goal[ID] is None:
+            return SETTLE_IDLE_POLL
+        return min(max(SETTLE_POLL_FRACTION * self.distance[ID] / self.speed, SETTLE_POLL_MIN), SETTLE_POLL_MAX)
+
+    #A new goal was sent to a servo, returns False when the goal did not change
+    def command(self, ID, goal, present, now):
+        if goal == self.goal[ID]:
+            return False
+        waiting = self.goal[ID] is not None and not self.settled[ID]
+        self.goal[ID] = goal
+        self.distance[ID] = abs(goal - present)
+        self.deadline[ID] = now + self.timeout
+        self.settled[ID] = False
+        self.timed_out[ID] = False
+        # A servo that is already being polled keeps its earlier poll so a stream of small goal changes cannot postpone it forever
+        poll = now + self.interval(ID)
+        self.next_poll[ID] = min(self.next_poll[ID], poll) if waiting else poll
+        return True
+
+    #Servos whose poll is due at time now
+    def due(self, now):
+        return [ID for ID in self.IDs if now >= self.next_poll[ID]]
+
+    #True when the Moving register of the servo should be read with its next poll
+    def near(self, ID):
+        return self.goal[ID] is not None and self.distance[ID] <= SETTLE_NEAR_FACTOR * self.threshold[ID]
+
+    #Take a polled present position (and Moving register, 1 when it was not read) and schedule the next poll
+    def update(self, ID, present, moving, now):
+        self.polls += 1
+        if self.goal[ID] is not None:
+            self.distance[ID] = abs(self.goal[ID] - present)
+            self.settled[ID] = self.distance[ID] <= self.threshold[ID] and not moving
+            if not self.settled[ID] and not self.timed_out[ID] and now >= self.deadline[ID]:
+                self.timed_out[ID] = True
+                self.timeouts += 1
+        self.next_poll[ID] = now + self.interval(ID)
+        return self.settled[ID]
+
+    #True when the last goals are finished under the settle policy
+    def done(self):
+        if self.policy == "any":
+            return any(self.settled.values())
+        if self.policy == "timeout":
+            return all(self.settled[ID] or self.timed_out[ID] for ID in self.IDs)
+        return all(self.settled.values())
+
+#Fixed-rate controller: every tick sends the newest Slidy Box goals (if any) and polls the servos the SettleDetector asks for
+#Stage times go to telemetry, settle is the time from a goal change until the command is finished under the settle policy
+class ControlLoop():
+    def __init__(self, bus, reader, rate_hz = CONTROL_RATE_HZ, channels = SLIDYBOX_CHANNELS, telemetry = None, settle_policy = SETTLE_POLICY, command_filter = None, spread_ids = SPREAD_IDS):
+        self.bus = bus
+        self.reader = reader
+        self.telemetry = telemetry or Telemetry()
+        self.settle = SettleDetector(bus.IDs, settle_policy, spread_ids = spread_ids)
+        self.filter = command_filter or CommandFilter(bus.IDs)
+        self.command_time = None
+        self.rate_hz = rate_hz
+        self.period = 1.0 / rate_hz
+        self.servos = [bus.servo(ID) for ID in bus.IDs]
+        self.servo_by_id = dict((servo.ID, servo) for servo in self.servos)
+        self.channels = channels
+        self.status = dict((ID, False) for ID in bus.IDs)
+        self.last_seq = 0
+        self.running = True
+
+        #Scheduling statistics
+        self.ticks = 0
+        self.frames = 0
+        self.deadline_misses = 0
+        self.jitter_bins = JITTER_BINS_MS
+        self.jitter_hist = [0] * (len(JITTER_BINS_MS) + 1)
+        self.max_jitter = 0.0
+        self.start_time = None
+        self.stop_time = None
+
+    #One control tick: write the goals the command filter lets through, then read back the servos whose settle poll is due
+    def tick(self):
+        seq, val, goals = self.reader.latest()
+        if goals is not None and seq != self.last_seq:
+            self.last_seq = seq
+            self.frames += 1
+            for servo in self.servos:
+                self.filter.set_target(servo.ID, goals[self.channels[servo.ID]])
+        start = clock()
+        commands = self.filter.update(start)
+        if commands:
+            for ID, goal in commands:
+                self.servo_by_id[ID].Move(goal)
+                self.settle.command(ID, goal, self.bus.present[ID], start)
+                self.status[ID] = False
+            self.bus.write_goals()
+            self.telemetry.record('write', clock() - start)
+            if self.command_time is None:
+                self.command_time = start
+
+        due = self.settle.due(clock())
+        if due:
+            start = clock()
+            near = [ID for ID in due if self.settle.near(ID)]
+            self.bus.read_servos(due, near)
+            now = clock()
+            self.telemetry.record('readback', now - start)
+            for ID in due:
+                if self.bus.comm_result[ID] != COMM_SUCCESS:
+                    self.settle.update(ID, self.bus.present[ID], 1, now)
+                    self.status[ID] = dynamixel.getTxRxResult(self.bus.pro_ver, self.bus.comm_result[ID])
+                else:
+                    self.status[ID] = self.settle.update(ID, self.bus.present[ID], self.bus.moving[ID] if ID in near else 1, now)
+        if self.command_time is not None and self.settle.done():
+            self.telemetry.record('settle', clock() - self.command_time)
+            self.command_time = None
+        self.bus.tick_stats()
+        self.ticks += 1
+        return None
+
+    #Run ticks at rate_hz until stop() or for duration seconds
+    #A tick that overruns its slot counts as a deadline miss and the schedule restarts from now instead of bursting to catch up
+    def run(self, duration = None):
+        self.running = True
+        self.start_time = clock()
+        scheduled = self.start_time
+        while self.running:
+            now = clock()
+            jitter = (now - scheduled) * 1000
+            self.jitter_hist[bisect.bisect_left(self.jitter_bins, jitter)] += 1
+            self.max_jitter = max(self.max_jitter, jitter)
+
+            self.tick()
+            if self.telemetry.summary_due():
+                print(self.summary())
+
+            scheduled += self.period
+            now = clock()
+            if duration is not None and now - self.start_time >= duration:
+                break
+            if now > scheduled:
+                self.deadline_misses += 1
+                scheduled = now
+            else:
+                time.sleep(scheduled - now)
+        self.stop_time = clock()
+        return None
+
+    def stop(self):
+        self.running = False
+        return None
+
+    #One status line: goal and present position of every servo and median stage times
+    def summary(self):
+        positions = "  ".join("[ID:%03d] %d/%d" % (ID, self.bus.goalpos[ID], self.bus.present[ID]) for ID in self.bus.IDs)
+        return "%s  |  %s" % (positions, self.telemetry.summary())
+
+    #Loop rate, deadline misses and jitter histogram as printable text
+    def report(self):
+        elapsed = (self.stop_time or clock()) - (self.start_time or clock())
+        lines = ["Control loop: %d ticks in %.2f s (%.1f Hz, target %.1f Hz), %d Slidy Box frames" % (self.ticks, elapsed, self.ticks / elapsed if elapsed > 0 else 0.0, self.rate_hz, self.frames)]
+        lines.append("Deadline misses: %d  Max jitter: %.3f ms" % (self.deadline_misses, self.max_jitter))
+        lower = 0
+        for edge, count in zip(self.jitter_bins + [float('inf')], self.jitter_hist):
+            lines.append("  jitter %6s - %-6s ms: %d" % (lower, edge, count))
+            lower = edge
+        if self.bus.ticks:
+            lines.append("Bus: %.1f packets/tick, %.3f ms/tick" % (float(self.bus.total_packets) / self.bus.ticks, self.bus.total_bus_time * 1000 / self.bus.ticks))
+        lines.append("Commands: %d servo goals written, %d within the %d tick deadband, %d stale Slidy Box frames dropped" % (self.filter.written, self.filter.suppressed, self.filter.deadband, self.reader.slidybox.stale))
+        lines.append("Settle (%s): %d servo polls, %d servo timeouts" % (self.settle.policy, self.settle.polls, self.settle.timeouts))
+        return "\n".join(lines)
 
 
 if __name__ == '__main__':
@@ -260,6 +871,11 @@ if __name__ == '__main__':
     #finger 3 (orange) = ID 4
     #Spread = ID 3    
 
+    if dynamixel is None:
+        sys.exit("Dynamixel SDK (dynamixel_functions) not found, see openhand_benchmark.py to run without hardware")
+
+    startup = clock()
+
     # Initialize PortHandler Structs (Leon, 2017) 
     # Set the port path (Leon, 2017)
     port_num = dynamixel.portHandler(DEVICENAME)
@@ -273,70 +889,70 @@ if __name__ == '__main__':
     status3 = 0
     status4 = 0
 
-    #Open port
+    #Open port and find servo ID 1,2,3,4 on one bus, stop straight away when the port or a servo is missing
     port = SetUp_(port_num)
-    if port.Open_port():
-        print("Succeeeded to open port!")
+    try:
+        if port.Open_port():
+            print("Succeeeded to open port!")
+    except IOError as e:
+        sys.exit("Openhand startup failed: %s" % e)
+    try:
         port.Set_baudrate()
-
-    #Initiate servo ID 1,2,3,4
-    ID_1 = Dynamixel_servo(port_num, PROTOCOL_VERSION, 1)
-    ID_2 = Dynamixel_servo(port_num, PROTOCOL_VERSION, 2)
-    ID_3 = Dynamixel_servo(port_num, PROTOCOL_VERSION, 3)
-    ID_4 = Dynamixel_servo(port_num, PROTOCOL_VERSION, 4)
-
-    #Print current position without goal pos
+        bus = ServoBus(port_num, PROTOCOL_VERSION, OPENHAND_IDS)
+        bus.scan()
+    except IOError as e:
+        port.Close_port()
+        sys.exit("Openhand startup failed: %s" % e)
+    ID_1 = bus.servo(1)
+    ID_2 = bus.servo(2)
+    ID_3 = bus.servo(3)
+    ID_4 = bus.servo(4)
+
+    #Print current position without goal pos (from the scan, no extra packets)
     status1 = ID_1.PresentPos_1()
     status2 = ID_2.PresentPos_1()
     status3 = ID_3.PresentPos_1()
     status4 = ID_4.PresentPos_1()
 
-    #Initiate torque for each servo
-    ID_1.EnableTorque()
-    ID_2.EnableTorque()
-    ID_3.EnableTorque()
-    ID_4.EnableTorque()
-
-    #Start Arduino Slidy Box
-    port = '/dev/ttyACM0'
-    b = 9600
-    val = []
-    s = Slidybox(port,b)
+    #Initiate torque for every servo at once
+    if not bus.set_torque(TORQUE_ENABLE):
+        port.Close_port()
+        sys.exit("Openhand startup failed: could not enable torque")
+    print("Startup: %d servos found and torque enabled in %.1f ms" % (len(bus.IDs), (clock() - startup) * 1000))
+
+    #Start Arduino Slidy Box and read it on its own thread
+    s = Slidybox(SLIDYBOX_PORT, SLIDYBOX_BAUDRATE, SLIDYBOX_BINARY)
+    if SLIDYBOX_CALIBRATION:
+        from openhand_calibration import load_profile
+        s.Use_calibration(load_profile(SLIDYBOX_CALIBRATION))
     s.Open_Slidybox()
-
-    #The controller starts.....
-    while 1:
-        print("Reading slidy box values.... (or press ESC to quit!)")        
-
-        #Read and print outputs from Arduino Slidy Box
-        print 'Arduino Slidy Box Output Values: {0}'.format(s.Read_Slidybox())
-        print 'Goal positions after mapping: {0}'.format(s.map())
-
-        #Move servos to goal positions
-        ID_1.Move(s.newval[2]) #Yellow
-        ID_2.Move(s.newval[0]) #Blue
-        ID_3.Move(s.newval[3]) #Spread
-        ID_4.Move(s.newval[1]) #Orange
-
-        #Print current finger and spread position to see if they meet corresponding goal postion
-        while 1:
-            status1 = ID_1.PresentPos_finger()
-            status2 = ID_2.PresentPos_finger()
-            status3 = ID_3.PresentPos_spread()
-            status4 = ID_4.PresentPos_finger()
-
-            #if actual position of each servo is less than 10 (finger) or 50 (spread), stop moving, otherwise keep moving
-            if status1 or status2 or status3 or status4:   
-                break
-
-    #Close each servo torque
-    ID_1.DisableTorque()
-    ID_2.DisableTorque()
-    ID_3.DisableTorque()
-    ID_4.DisableTorque()
+    telemetry = Telemetry()
+    reader = SlidyboxReader(s, telemetry)
+    reader.start()
+
+    #Record goal/present of every servo when a recording file is given as second argument
+    if len(sys.argv) > 2:
+        from openhand_recorder import ServoRecorder
+        bus.recorder = ServoRecorder(sys.argv[2])
+
+    #The controller starts..... (python openhand_controller_final.py [rate_hz] [recording.bin])
+    rate_hz = float(sys.argv[1]) if len(sys.argv) > 1 else CONTROL_RATE_HZ
+    loop = ControlLoop(bus, reader, rate_hz, telemetry = telemetry)
+    print("Running control loop at %.1f Hz (press Ctrl-C to quit!)" % rate_hz)
+    try:
+        loop.run()
+    except KeyboardInterrupt:
+        pass
+    reader.stop()
+    print(loop.report())
+    telemetry.dump(TELEMETRY_FILE)
+    print("Stage timings written to %s" % TELEMETRY_FILE)
+    if bus.recorder is not None:
+        bus.recorder.close()
+        print("%d servo records written to %s" % (bus.recorder.records, bus.recorder.path))
+
+    #Close every servo torque
+    bus.set_torque(TORQUE_DISABLE)
     
     #Close USB port for Openhand
     port.Close_port()
-
-
-
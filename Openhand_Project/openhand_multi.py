@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###########################################################
+#Controller for several Openhands, each on its own Dynamixel port with its own Slidy Box
+#Every hand runs its ControlLoop on a worker thread, so the serial I/O of the buses overlaps (the Dynamixel SDK
+#is called through ctypes, which releases the interpreter lock while a packet is on the wire).
+#A Supervisor opens every port and enables torque, prints the aggregate loop rate, and disables torque and closes
+#every port on shutdown.
+#Config is a JSON file: {"hands": [{"name": "left", "device": "/dev/ttyUSB0", "slidybox": "/dev/ttyACM0"}, ...]}
+#Keys left out of a hand take the single-hand defaults in HAND_DEFAULTS.
+#Usage: python openhand_multi.py hands.json [--duration 10] [--sim]
+#############################################################
+
+import sys
+import json
+import time
+import argparse
+import threading
+
+import openhand_controller_final as controller
+
+HAND_DEFAULTS = {
+    'device': controller.DEVICENAME,
+    'baudrate': controller.BAUDRATE,
+    'ids': controller.OPENHAND_IDS,
+    'spread_ids': controller.SPREAD_IDS,
+    'channels': controller.SLIDYBOX_CHANNELS,
+    'slidybox': controller.SLIDYBOX_PORT,
+    'slidybox_baudrate': controller.SLIDYBOX_BAUDRATE,
+    'binary': controller.SLIDYBOX_BINARY,
+    'rate_hz': controller.CONTROL_RATE_HZ,
+    'settle_policy': controller.SETTLE_POLICY,
+    'calibration': controller.SLIDYBOX_CALIBRATION,        # Per-hand calibration profile (.npz), None uses the linear scales
+}
+REPORT_PERIOD               = 1.0                           # Seconds between supervisor status lines
+
+#Read the hand list of a config file, filling in defaults (JSON object keys are strings, channel IDs become ints)
+def load_config(path):
+    with open(path) as f:
+        config = json.load(f)
+    hands = []
+    for i, entry in enumerate(config['hands']):
+        hand = dict(HAND_DEFAULTS)
+        hand['name'] = 'hand%d' % (i + 1)
+        hand.update(entry)
+        hand['channels'] = dict((int(ID), channel) for ID, channel in hand['channels'].items())
+        missing = [ID for ID in hand['ids'] if ID not in hand['channels']]
+        if missing:
+            raise ValueError("%s: no Slidy Box channel for servo IDs %s" % (hand['name'], missing))
+        hands.append(hand)
+    names = [hand['name'] for hand in hands]
+    if len(set(names)) != len(names):
+        raise ValueError("hand names must be unique: %s" % names)
+    return hands
+
+#One Openhand: port, servo bus, Slidy Box reader and a ControlLoop on its own worker thread
+class Hand():
+    def __init__(self, config):
+        self.config = config
+        self.name = config['name']
+        self.port_num = None
+        self.port = None
+        self.bus = None
+        self.reader = None
+        self.loop = None
+        self.worker = None
+        self.error = None
+
+    #Register the Dynamixel port with the SDK, every port must be registered before packetHandler() is called
+    def register(self):
+        self.port_num = controller.dynamixel.portHandler(self.config['device'])
+        return None
+
+    #Open the registered port, check every servo answers and enable torque on all of them, IOError names what failed
+    def open(self):
+        self.port = controller.SetUp_(self.port_num, self.config['baudrate'])
+        try:
+            self.port.Open_port()
+            self.port.Set_baudrate()
+            self.bus = controller.ServoBus(self.port_num, controller.PROTOCOL_VERSION, self.config['ids'])
+            self.bus.scan()
+            if not self.bus.set_torque(controller.TORQUE_ENABLE):
+                raise IOError("could not enable torque")
+        except IOError as e:
+            raise IOError("%s (%s): %s" % (self.name, self.config['device'], e))
+        return None
+
+    #Start the Slidy Box reader and the control loop worker
+    def start(self):
+        s = controller.Slidybox(self.config['slidybox'], self.config['slidybox_baudrate'], self.config['binary'])
+        if self.config['calibration']:
+            from openhand_calibration import load_profile
+            s.Use_calibration(load_profile(self.config['calibration']), self.config['channels'])
+        s.Open_Slidybox()
+        #The supervisor prints for every hand, so the per-loop summary line is switched off
+        telemetry = controller.Telemetry(summary_period = float('inf'))
+        self.reader = controller.SlidyboxReader(s, telemetry)
+        self.reader.start()
+        self.loop = controller.ControlLoop(self.bus, self.reader, self.config['rate_hz'], self.config['channels'], telemetry, self.config['settle_policy'], spread_ids = self.config['spread_ids'])
+        self.worker = threading.Thread(target = self.run)
+        self.worker.daemon = True
+        self.worker.start()
+        return None
+
+    #Worker thread body, an exception stops this hand and is kept for the supervisor
+    def run(self):
+        try:
+            self.loop.run()
+        except Exception as e:
+            self.error = e
+        return None
+
+    def alive(self):
+        return self.worker is not None and self.worker.is_alive()
+
+    #Stop the loop and reader, disable torque and close the port
+    def close(self):
+        if self.loop is not None:
+            self.loop.stop()
+        if self.worker is not None:
+            self.worker.join(1.0)
+        if self.reader is not None:
+            self.reader.stop()
+            self.reader.join(1.0)
+        if self.bus is not None:
+            self.bus.set_torque(controller.TORQUE_DISABLE)
+        if self.port is not None:
+            self.port.Close_port()
+        return None
+
+#Starts, watches and shuts down every hand
+class Supervisor():
+    def __init__(self, hands, report_period = REPORT_PERIOD):
+        self.hands = [Hand(config) for config in hands]
+        self.report_period = report_period
+        self.start_time = None
+        self.stop_time = None
+
+    #Enable torque on every hand before any loop starts, a hand that fails to open shuts the others down again
+    #The SDK sizes its packet buffers in packetHandler() for the ports registered so far, so every port is registered
+    #first and packetHandler() runs once before any port is opened
+    def start(self):
+        try:
+            for hand in self.hands:
+                hand.register()
+            controller.dynamixel.packetHandler()
+            for hand in self.hands:
+                hand.open()
+            for hand in self.hands:
+                hand.start()
+        except Exception:
+            self.shutdown()
+            raise
+        self.start_time = controller.clock()
+        return None
+
+    #Print loop rates every report period until duration ends, a worker stops or Ctrl-C
+    def run(self, duration = None):
+        last_ticks = [0] * len(self.hands)
+        last_time = controller.clock()
+        try:
+            while all(hand.alive() for hand in self.hands):
+                time.sleep(self.report_period)
+                now = controller.clock()
+                ticks = [hand.loop.ticks for hand in self.hands]
+                rates = [(t - l) / (now - last_time) for t, l in zip(ticks, last_ticks)]
+                print("  ".join("%s %.1f Hz" % (hand.name, rate) for hand, rate in zip(self.hands, rates)) + "  |  total %.1f Hz" % sum(rates))
+                last_ticks = ticks
+                last_time = now
+                if duration is not None and now - self.start_time >= duration:
+                    break
+        except KeyboardInterrupt:
+            pass
+        self.stop_time = controller.clock()
+        return None
+
+    #Stop every loop first so no hand is still commanding while another is disabled, then release the hardware
+    def shutdown(self):
+        for hand in self.hands:
+            if hand.loop is not None:
+                hand.loop.stop()
+        for hand in self.hands:
+            hand.close()
+        if self.start_time is not None and self.stop_time is None:
+            self.stop_time = controller.clock()
+        return None
+
+    #Per-hand loop reports and the aggregate rate as printable text
+    def report(self):
+        lines = []
+        total = 0
+        for hand in self.hands:
+            if hand.loop is None:
+                continue
+            lines.append("[%s] %s" % (hand.name, hand.config['device']))
+            lines.append(hand.loop.report())
+            if hand.error is not None:
+                lines.append("Stopped by error: %r" % hand.error)
+            total += hand.loop.ticks
+        if self.start_time is not None:
+            elapsed = self.stop_time - self.start_time
+            lines.append("All hands: %d ticks in %.2f s (%.1f Hz aggregate over %d hands)" % (total, elapsed, total / elapsed if elapsed > 0 else 0.0, len(self.hands)))
+        return "\n".join(lines)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Run several Openhands, one worker thread per Dynamixel port')
+    parser.add_argument('config', help = 'JSON file with a "hands" list')
+    parser.add_argument('--duration', type = float, default = None, help = 'seconds to run (default: until Ctrl-C)')
+    parser.add_argument('--sim', action = 'store_true', help = 'run against openhand_sim instead of the hardware')
+    args = parser.parse_args()
+
+    hands = load_config(args.config)
+    if args.sim:
+        import openhand_sim as sim
+        controller.use_backend(sim.SimDynamixel(sorted(set(ID for hand in hands for ID in hand['ids']))), sim.SimSerialModule())
+    elif controller.dynamixel is None:
+        sys.exit("Dynamixel SDK (dynamixel_functions) not found, use --sim to run without hardware")
+
+    supervisor = Supervisor(hands)
+    startup = controller.clock()
+    try:
+        supervisor.start()
+    except IOError as e:
+        sys.exit("Openhand startup failed: %s" % e)
+    print("Startup: %d hands ready in %.1f ms" % (len(hands), (controller.clock() - startup) * 1000))
+    print("Running %d hands (press Ctrl-C to quit!)" % len(hands))
+    supervisor.run(args.duration)
+    supervisor.shutdown()
+    print(supervisor.report())
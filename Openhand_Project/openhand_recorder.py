@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###########################################################
+#Binary recording of Openhand servo state at full loop rate, and offline replay
+#ServoRecorder takes fixed-width records (timestamp, ID, goal, present, comm result) into preallocated numpy
+#batches and a background thread appends full batches to the file, so the control loop never waits on disk.
+#Attach it with bus.recorder = ServoRecorder(path) (or servo.recorder for a servo without a bus).
+#Replay: python openhand_recorder.py recording.bin [--realtime]
+#############################################################
+
+import sys
+import argparse
+import threading
+import numpy as np
+
+from openhand_telemetry import clock
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue                                   # Python 2
+
+RECORD_MAGIC                = b'OHREC001'                   # File header, followed directly by records
+RECORD_DTYPE                = np.dtype([('t', '<f8'), ('id', 'u1'), ('goal', '<i2'), ('present', '<i2'), ('comm', '<i2')])
+RECORD_BATCH                = 4096                          # Records per batch handed to the writer thread
+RECORD_POOL                 = 4                             # Batches allocated up front
+
+class ServoRecorder():
+    def __init__(self, path, batch = RECORD_BATCH):
+        self.path = path
+        self.file = open(path, 'wb')
+        self.file.write(RECORD_MAGIC)
+        self.batch_size = batch
+        self.free = queue.Queue()
+        for i in range(RECORD_POOL - 1):
+            self.free.put(np.zeros(batch, dtype = RECORD_DTYPE))
+        self.batch = np.zeros(batch, dtype = RECORD_DTYPE)
+        self.n = 0
+        self.records = 0
+        self.pending = queue.Queue()
+        self.thread = threading.Thread(target = self.writer)
+        self.thread.daemon = True
+        self.thread.start()
+
+    #Append one record, called from the control loop
+    def record(self, t, ID, goal, present, comm):
+        self.batch[self.n] = (t, ID, goal, present, comm)
+        self.n += 1
+        if self.n == self.batch_size:
+            self.flush()
+        return None
+
+    #Hand the current batch to the writer thread and continue in a free one (a new one if the writer is behind)
+    def flush(self):
+        if self.n == 0:
+            return None
+        self.pending.put((self.batch, self.n))
+        self.records += self.n
+        try:
+            self.batch = self.free.get_nowait()
+        except queue.Empty:
+            self.batch = np.zeros(self.batch_size, dtype = RECORD_DTYPE)
+        self.n = 0
+        return None
+
+    #Background thread: write batches in order until close()
+    def writer(self):
+        while True:
+            item = self.pending.get()
+            if item is None:
+                break
+            batch, n = item
+            batch[:n].tofile(self.file)
+            self.free.put(batch)
+        return None
+
+    def close(self):
+        self.flush()
+        self.pending.put(None)
+        self.thread.join()
+        self.file.close()
+        return None
+
+#Read a recording into a structured array with the RECORD_DTYPE fields
+def load_recording(path):
+    with open(path, 'rb') as f:
+        if f.read(len(RECORD_MAGIC)) != RECORD_MAGIC:
+            raise ValueError("%s is not an Openhand servo recording" % path)
+        return np.fromfile(f, dtype = RECORD_DTYPE)
+
+#Commanded goals of a recording: (times, goals) with one row per goal change, columns in IDs order
+#Each row holds the goals of every servo as last recorded at that time
+def recorded_goals(records, IDs):
+    goals = np.zeros((len(records), len(IDs)), dtype = np.int64)
+    seen = np.zeros(len(IDs), dtype = bool)
+    for column, ID in enumerate(IDs):
+        mine = records['id'] == ID
+        seen[column] = mine.any()
+        #Forward-fill the goal of this servo over records of the other servos
+        index = np.where(mine, np.arange(len(records)), 0)
+        np.maximum.accumulate(index, out = index)
+        goals[:, column] = records['goal'][index]
+    if not seen.all():
+        raise ValueError("recording has no records for servo IDs %s" % [ID for ID, s in zip(IDs, seen) if not s])
+    first = max(np.argmax(records['id'] == ID) for ID in IDs)
+    changed = np.concatenate([[True], (np.diff(goals[first:], axis = 0) != 0).any(axis = 1)])
+    rows = first + np.flatnonzero(changed)
+    return records['t'][rows], goals[rows]
+
+#Slidy Box values that map back onto the given goals (inverse of Slidybox.map, the +0.5 keeps trunc on the same tick)
+def goals_to_slider(goals, slidybox):
+    return (goals - slidybox.offset + 0.5 * np.sign(slidybox.scale)) / slidybox.scale
+
+#Replay a recording offline: rebuild the Slidy Box frames, check that Slidybox.map gives the recorded goals back,
+#and (realtime) drive ControlLoop on the simulated hand with the frames at their recorded timing
+def replay(path, realtime = False, rate_hz = None):
+    import openhand_controller_final as controller
+    import openhand_sim as sim
+
+    records = load_recording(path)
+    IDs = sorted(set(records['id'].tolist()))
+    times, goals = recorded_goals(records, IDs)
+    channels = [controller.SLIDYBOX_CHANNELS[ID] for ID in IDs]
+    frame_goals = np.zeros((len(goals), controller.SLIDYBOX_CHANNEL_COUNT), dtype = np.int64)
+    frame_goals[:, channels] = goals
+
+    dxl = sim.SimDynamixel(IDs)
+    frames = []
+    serial_module = sim.SimSerialModule(source = lambda t: frames[min(np.searchsorted(times - times[0], t, side = 'right'), len(frames)) - 1])
+    controller.use_backend(dxl, serial_module)
+    s = controller.Slidybox(controller.SLIDYBOX_PORT, controller.SLIDYBOX_BAUDRATE)
+    frames.extend(goals_to_slider(frame_goals, s).tolist())
+
+    #Mapping pass, as fast as possible
+    start = clock()
+    mismatches = 0
+    for frame, expected in zip(frames, frame_goals):
+        s.val[:] = frame
+        if (s.map()[channels] != expected[channels]).any():
+            mismatches += 1
+    elapsed = clock() - start
+    print("%s: %d records, %d servo(s), %d goal frames over %.2f s" % (path, len(records), len(IDs), len(frames), times[-1] - times[0]))
+    print("Mapping: %d frames in %.3f s (%.0f frames/s), %d frame(s) not reproducing the recorded goals" % (len(frames), elapsed, len(frames) / elapsed if elapsed > 0 else 0.0, mismatches))
+
+    #Closed loop pass on the simulated hand
+    if realtime:
+        duration = max(times[-1] - times[0], 0.1)
+        serial_module.rate_hz = len(frames) / duration if rate_hz is None else rate_hz
+        port_num = dxl.portHandler(controller.DEVICENAME)
+        for ID in IDs:
+            controller.Dynamixel_servo(port_num, controller.PROTOCOL_VERSION, ID).EnableTorque()
+        s = controller.Slidybox(controller.SLIDYBOX_PORT, controller.SLIDYBOX_BAUDRATE)
+        bus = controller.ServoBus(port_num, controller.PROTOCOL_VERSION, IDs)
+        telemetry = controller.Telemetry()
+        reader = controller.SlidyboxReader(s, telemetry)
+        reader.start()
+        loop = controller.ControlLoop(bus, reader, telemetry = telemetry)
+        loop.run(duration)
+        reader.stop()
+        reader.join(1.0)
+        print(loop.report())
+        print(telemetry.summary())
+    return mismatches
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Replay an Openhand servo recording offline')
+    parser.add_argument('recording')
+    parser.add_argument('--realtime', action = 'store_true', help = 'also run the control loop on the simulated hand at the recorded timing')
+    args = parser.parse_args()
+    sys.exit(1 if replay(args.recording, args.realtime) else 0)
@@ -0,0 +1,382 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###########################################################
+#Simulated hardware for the Openhand controller
+#SimDynamixel stands in for the dynamixel_functions module (protocol 1.0, MX-28 control table) and
+#SimSerialModule stands in for pyserial with an Arduino Slidy Box that streams lines at a fixed rate.
+#Both sleep for the time the real packets would take on the wire, so loop rates measured against them are realistic.
+#Use with openhand_controller_final.use_backend(SimDynamixel(), SimSerialModule())
+#############################################################
+
+import math
+import struct
+import threading
+import time
+
+from openhand_telemetry import clock
+
+# Same control table addresses as the controller (MX series)
+ADDR_MX_TORQUE_ENABLE       = 24
+ADDR_MX_GOAL_POSITION       = 30
+ADDR_MX_PRESENT_POSITION    = 36
+ADDR_MX_MOVING              = 46
+
+COMM_SUCCESS                = 0                             # Communication Success result value
+COMM_TX_FAIL                = -1001                         # Communication Tx Failed
+COMM_RX_TIMEOUT             = -3001                         # There is no status packet
+
+PACKET_OVERHEAD             = 6                             # 0xFF 0xFF ID LENGTH INSTRUCTION/ERROR CHECKSUM
+BITS_PER_BYTE               = 10                            # 8N1 serial framing
+RETURN_DELAY                = 0.0005                        # MX default Return Delay Time (250 * 2 us)
+RX_TIMEOUT                  = 0.016                         # Time lost waiting for a servo that never answers
+MX_TICKS_PER_SEC            = 55 * 4096 / 60.0              # MX-28 no-load speed (55 rpm) in position ticks per second
+
+#Sleep until the given clock() time, finishing with a short spin for sub-millisecond accuracy
+def sleep_until(deadline):
+    remaining = deadline - clock()
+    if remaining > 0.002:
+        time.sleep(remaining - 0.001)
+    while clock() < deadline:
+        pass
+    return None
+
+#One simulated MX servo moving toward its goal at constant speed while torque is on
+class SimServo():
+    def __init__(self, ID, position = 2048, speed = MX_TICKS_PER_SEC):
+        self.ID = ID
+        self.position = float(position)
+        self.goal = int(position)
+        self.speed = speed
+        self.torque = 0
+        self.stamp = clock()
+
+    #Advance the servo to time now
+    def update(self, now):
+        dt = now - self.stamp
+        self.stamp = now
+        if not self.torque:
+            return None
+        step = self.speed * dt
+        error = self.goal - self.position
+        if abs(error) <= step:
+            self.position = float(self.goal)
+        else:
+            self.position += math.copysign(step, error)
+        return None
+
+    def read(self, addr):
+        self.update(clock())
+        if addr == ADDR_MX_PRESENT_POSITION:
+            return int(round(self.position))
+        if addr == ADDR_MX_GOAL_POSITION:
+            return self.goal
+        if addr == ADDR_MX_TORQUE_ENABLE:
+            return self.torque
+        if addr == ADDR_MX_MOVING:
+            return int(self.torque and abs(self.goal - self.position) >= 1)
+        return 0
+
+    def write(self, addr, value):
+        self.update(clock())
+        if addr == ADDR_MX_GOAL_POSITION:
+            self.goal = int(value)
+        elif addr == ADDR_MX_TORQUE_ENABLE:
+            self.torque = int(value)
+        return None
+
+#One simulated Dynamixel port: its own servos, lock, last results and bus statistics
+class SimPort():
+    def __init__(self, devicename, IDs, baudrate):
+        self.devicename = devicename
+        self.servos = dict((ID, SimServo(ID)) for ID in IDs)
+        self.baudrate = baudrate
+        self.lock = threading.Lock()
+        self.comm_result = COMM_SUCCESS
+        self.rx_error = 0
+
+        #Bus statistics
+        self.tx_packets = 0
+        self.rx_packets = 0
+        self.bytes = 0
+        self.bus_time = 0.0
+
+#Stand-in for the dynamixel_functions module: same function names and arguments, backed by SimServo objects
+#Every portHandler() call opens a new SimPort with servos IDs, so several hands can run on one SimDynamixel
+class SimDynamixel():
+    def __init__(self, IDs = (1, 2, 3, 4), baudrate = 57600, return_delay = RETURN_DELAY, realtime = True):
+        self.IDs = list(IDs)
+        self.baudrate = baudrate
+        self.return_delay = return_delay
+        self.realtime = realtime
+        self.ports = []
+        self.groups = []
+
+    #Account for one transaction on a port: tx instruction bytes, then one status packet per rx_sizes entry
+    def transfer(self, port, tx_size, rx_sizes = (), timeouts = 0):
+        duration = (tx_size + sum(rx_sizes)) * BITS_PER_BYTE / float(port.baudrate)
+        duration += self.return_delay * len(rx_sizes) + RX_TIMEOUT * timeouts
+        port.tx_packets += 1
+        port.rx_packets += len(rx_sizes)
+        port.bytes += tx_size + sum(rx_sizes)
+        port.bus_time += duration
+        if self.realtime:
+            sleep_until(clock() + duration)
+        return None
+
+    #Reset bus statistics of every port, returning the old totals as (tx packets, rx packets, bytes, bus seconds)
+    def reset_stats(self):
+        stats = (sum(port.tx_packets for port in self.ports), sum(port.rx_packets for port in self.ports), sum(port.bytes for port in self.ports), sum(port.bus_time for port in self.ports))
+        for port in self.ports:
+            port.tx_packets = 0
+            port.rx_packets = 0
+            port.bytes = 0
+            port.bus_time = 0.0
+        return stats
+
+    # Port handling
+    def portHandler(self, devicename):
+        self.ports.append(SimPort(devicename, self.IDs, self.baudrate))
+        return len(self.ports) - 1
+
+    def packetHandler(self):
+        return None
+
+    def openPort(self, port_num):
+        return True
+
+    def setBaudRate(self, port_num, baudrate):
+        self.ports[port_num].baudrate = baudrate
+        return True
+
+    def closePort(self, port_num):
+        return None
+
+    # Results
+    def getLastTxRxResult(self, port_num, pro_ver):
+        return self.ports[port_num].comm_result
+
+    def getLastRxPacketError(self, port_num, pro_ver):
+        return self.ports[port_num].rx_error
+
+    def getTxRxResult(self, pro_ver, result):
+        if result == COMM_RX_TIMEOUT:
+            return "[TxRxResult] There is no status packet!"
+        if result == COMM_TX_FAIL:
+            return "[TxRxResult] Failed transmit instruction packet!"
+        return "[TxRxResult] Communication success."
+
+    def getRxPacketError(self, pro_ver, error):
+        return "[RxPacketError] Unknown error code!"
+
+    # Single servo transactions
+    def txrx(self, port_num, ID, tx_size, rx_size):
+        port = self.ports[port_num]
+        with port.lock:
+            servo = port.servos.get(ID)
+            if servo is None:
+                self.transfer(port, tx_size, timeouts = 1)
+                port.comm_result = COMM_RX_TIMEOUT
+            else:
+                self.transfer(port, tx_size, [rx_size])
+                port.comm_result = COMM_SUCCESS
+            port.rx_error = 0
+            return servo
+
+    def ping(self, port_num, pro_ver, ID):
+        self.txrx(port_num, ID, PACKET_OVERHEAD, PACKET_OVERHEAD)
+        return None
+
+    def write1ByteTxRx(self, port_num, pro_ver, ID, addr, data):
+        servo = self.txrx(port_num, ID, PACKET_OVERHEAD + 2, PACKET_OVERHEAD)
+        if servo is not None:
+            servo.write(addr, data)
+        return None
+
+    def write2ByteTxRx(self, port_num, pro_ver, ID, addr, data):
+        servo = self.txrx(port_num, ID, PACKET_OVERHEAD + 3, PACKET_OVERHEAD)
+        if servo is not None:
+            servo.write(addr, data)
+        return None
+
+    def read1ByteTxRx(self, port_num, pro_ver, ID, addr):
+        servo = self.txrx(port_num, ID, PACKET_OVERHEAD + 2, PACKET_OVERHEAD + 1)
+        return 0 if servo is None else servo.read(addr)
+
+    def read2ByteTxRx(self, port_num, pro_ver, ID, addr):
+        servo = self.txrx(port_num, ID, PACKET_OVERHEAD + 2, PACKET_OVERHEAD + 2)
+        return 0 if servo is None else servo.read(addr)
+
+    # Group sync write (no status packets)
+    def groupSyncWrite(self, port_num, pro_ver, addr, length):
+        self.groups.append({'port': port_num, 'addr': addr, 'length': length, 'params': {}})
+        return len(self.groups) - 1
+
+    def groupSyncWriteAddParam(self, group_num, ID, data, length):
+        params = self.groups[group_num]['params']
+        if ID in params:
+            return 0
+        params[ID] = data
+        return 1
+
+    def groupSyncWriteChangeParam(self, group_num, ID, data, length):
+        self.groups[group_num]['params'][ID] = data
+        return 1
+
+    def groupSyncWriteClearParam(self, group_num):
+        self.groups[group_num]['params'] = {}
+        return None
+
+    def groupSyncWriteTxPacket(self, group_num):
+        group = self.groups[group_num]
+        port = self.ports[group['port']]
+        with port.lock:
+            self.transfer(port, PACKET_OVERHEAD + 2 + len(group['params']) * (1 + group['length']))
+            for ID, data in group['params'].items():
+                if ID in port.servos:
+                    port.servos[ID].write(group['addr'], data)
+            port.comm_result = COMM_SUCCESS
+        return None
+
+    # Group bulk read (one status packet per servo)
+    def groupBulkRead(self, port_num, pro_ver):
+        self.groups.append({'port': port_num, 'params': {}, 'data': {}})
+        return len(self.groups) - 1
+
+    def groupBulkReadAddParam(self, group_num, ID, addr, length):
+        params = self.groups[group_num]['params']
+        if ID in params:
+            return 0
+        params[ID] = (addr, length)
+        return 1
+
+    def groupBulkReadClearParam(self, group_num):
+        self.groups[group_num]['params'] = {}
+        return None
+
+    def groupBulkReadTxRxPacket(self, group_num):
+        group = self.groups[group_num]
+        port = self.ports[group['port']]
+        with port.lock:
+            present = [ID for ID in group['params'] if ID in port.servos]
+            missing = len(group['params']) - len(present)
+            self.transfer(port, PACKET_OVERHEAD + 1 + 3 * len(group['params']), [PACKET_OVERHEAD + group['params'][ID][1] for ID in present], missing)
+            group['data'] = dict((ID, self.read_range(port.servos[ID], *group['params'][ID])) for ID in present)
+            port.comm_result = COMM_RX_TIMEOUT if missing else COMM_SUCCESS
+            port.rx_error = 0
+        return None
+
+    #Registers the servo returns for a read of length bytes from addr, as {address: value}
+    def read_range(self, servo, addr, length):
+        return dict((a, servo.read(a)) for a in (ADDR_MX_TORQUE_ENABLE, ADDR_MX_GOAL_POSITION, ADDR_MX_PRESENT_POSITION, ADDR_MX_MOVING) if addr <= a < addr + length)
+
+    def groupBulkReadIsAvailable(self, group_num, ID, addr, length):
+        group = self.groups[group_num]
+        if ID not in group['data']:
+            return 0
+        start, size = group['params'][ID]
+        return int(start <= addr and addr + length <= start + size)
+
+    def groupBulkReadGetData(self, group_num, ID, addr, length):
+        return self.groups[group_num]['data'].get(ID, {}).get(addr, 0)
+
+#Default Slidy Box input: slow sine sweeps of the three fingers and the spread
+def sweep_source(t):
+    return [1.25 + 1.25 * math.sin(0.5 * t), 1.25 + 1.25 * math.sin(0.5 * t + 1), 1.25 + 1.25 * math.sin(0.5 * t + 2), 1.57 + 1.57 * math.sin(0.2 * t)]
+
+#Simulated Arduino serial port: a new line (or binary frame) is emitted every 1/rate_hz seconds, limited by the baud rate.
+#Emitted bytes that have not been read yet wait in an input buffer like the OS serial buffer
+class SimSerial():
+    def __init__(self, port = None, baudrate = 9600, timeout = None, rate_hz = 50, binary = False, source = sweep_source):
+        self.port = port
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.rate_hz = rate_hz
+        self.binary = binary
+        self.source = source
+        self.buffer = bytearray()
+        self.start = clock()
+        self.count = 0
+        self.next_time = self.start
+        self.is_open = True
+
+    #Encode one Slidy Box output
+    def encode(self, val):
+        if self.binary:
+            payload = struct.pack('<%df' % len(val), *val)
+            return bytearray([0xAA, 0x55]) + bytearray(payload) + bytearray([sum(bytearray(payload)) & 0xFF])
+        return bytearray((",".join("%.3f" % x for x in val) + "\r\n").encode('ascii'))
+
+    #Move every output emitted up to now into the input buffer, waiting for the next one when block is set
+    #Returns False when the read timeout ran out before the next output
+    def fill(self, block):
+        if block and clock() < self.next_time:
+            if self.timeout is not None and self.next_time - clock() > self.timeout:
+                time.sleep(self.timeout)
+                return False
+            sleep_until(self.next_time)
+        now = clock()
+        while self.next_time <= now:
+            data = self.encode(self.source(self.next_time - self.start))
+            self.buffer += data
+            self.count += 1
+            wire_time = len(data) * BITS_PER_BYTE / float(self.baudrate)
+            self.next_time = max(self.start + self.count / float(self.rate_hz), self.next_time + wire_time)
+        return True
+
+    @property
+    def in_waiting(self):
+        self.fill(False)
+        return len(self.buffer)
+
+    def inWaiting(self):
+        return self.in_waiting
+
+    def readline(self):
+        self.fill(False)
+        while b"\n" not in self.buffer:
+            if not self.fill(True):
+                break
+        end = self.buffer.index(b"\n") + 1 if b"\n" in self.buffer else len(self.buffer)
+        line = bytes(self.buffer[:end])
+        del self.buffer[:end]
+        return line
+
+    def read(self, size = 1):
+        self.fill(False)
+        while len(self.buffer) < size:
+            if not self.fill(True):
+                break
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+    def readinto(self, b):
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def reset_input_buffer(self):
+        self.fill(False)
+        del self.buffer[:]
+        return None
+
+    def flushInput(self):
+        return self.reset_input_buffer()
+
+    def close(self):
+        self.is_open = False
+        return None
+
+#Stand-in for the pyserial module: Serial(port, baudrate) opens a SimSerial with the module's stream settings
+class SimSerialModule():
+    def __init__(self, rate_hz = 50, binary = False, source = sweep_source):
+        self.rate_hz = rate_hz
+        self.binary = binary
+        self.source = source
+        self.opened = []
+
+    def Serial(self, port = None, baudrate = 9600, timeout = None, **kwargs):
+        ser = SimSerial(port, baudrate, timeout, self.rate_hz, self.binary, self.source)
+        self.opened.append(ser)
+        return ser
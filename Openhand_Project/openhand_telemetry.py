@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###########################################################
+#Low-overhead timing of the Openhand controller stages
+#Every stage has its own preallocated ring buffer of durations, so stages timed on the Slidy Box reader thread
+#and on the control loop thread never share a write position and no lock is needed.
+#############################################################
+
+import time
+import numpy as np
+
+TELEMETRY_STAGES            = ['serial_read', 'parse_map', 'write', 'readback', 'settle']
+TELEMETRY_CAPACITY          = 8192                          # Samples kept per stage
+TELEMETRY_SUMMARY_PERIOD    = 1.0                           # Seconds between summary lines
+
+# Wall clock (time.perf_counter is not available on Python 2)
+clock = getattr(time, 'perf_counter', time.time)
+
+class Telemetry():
+    def __init__(self, stages = TELEMETRY_STAGES, capacity = TELEMETRY_CAPACITY, summary_period = TELEMETRY_SUMMARY_PERIOD):
+        self.stages = list(stages)
+        self.index = dict((stage, i) for i, stage in enumerate(self.stages))
+        self.capacity = capacity
+        self.buffer = np.zeros((len(self.stages), capacity))
+        self.count = [0] * len(self.stages)
+        self.summary_period = summary_period
+        self.next_summary = clock() + summary_period
+
+    #Store the duration (seconds) of one run of a stage
+    def record(self, stage, seconds):
+        i = self.index[stage]
+        self.buffer[i, self.count[i] % self.capacity] = seconds
+        self.count[i] += 1
+        return None
+
+    #Durations currently held for a stage (the newest capacity samples, unordered)
+    def samples(self, stage):
+        i = self.index[stage]
+        return self.buffer[i, :min(self.count[i], self.capacity)]
+
+    #{stage: (samples seen, p50, p99, max)} in seconds, stages without samples are left out
+    def stats(self):
+        result = {}
+        for stage in self.stages:
+            data = self.samples(stage)
+            if len(data):
+                p50, p99 = np.percentile(data, [50, 99])
+                result[stage] = (self.count[self.index[stage]], p50, p99, data.max())
+        return result
+
+    #True once per summary period, for rate-limited printing
+    def summary_due(self, now = None):
+        now = clock() if now is None else now
+        if now < self.next_summary:
+            return False
+        self.next_summary = now + self.summary_period
+        return True
+
+    #One line with the median duration of every stage in ms
+    def summary(self):
+        stats = self.stats()
+        return "  ".join("%s %.2f ms" % (stage, stats[stage][1] * 1000) for stage in self.stages if stage in stats)
+
+    #Write p50/p99/max per stage (ms) to a text file
+    def dump(self, path):
+        stats = self.stats()
+        with open(path, 'w') as f:
+            f.write("%-12s %10s %10s %10s %10s\n" % ('stage', 'samples', 'p50_ms', 'p99_ms', 'max_ms'))
+            for stage in self.stages:
+                if stage in stats:
+                    count, p50, p99, peak = stats[stage]
+                    f.write("%-12s %10d %10.3f %10.3f %10.3f\n" % (stage, count, p50 * 1000, p99 * 1000, peak * 1000))
+        return None